@@ -0,0 +1,114 @@
+"""Measure memory used by resource objects with loaded tags.
+
+Usage: python benchmarks/memory_usage.py [--baseline <git revision>] [<number of resources>] [<tags per resource>]
+
+The same measurement is made with `cfalchemy` package of the baseline revision (by default the one before
+    the compact object layouts were introduced) in a subprocess, so both footprints are reported side by side.
+    Use `--baseline ''` to measure the working tree only.
+"""
+import argparse
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import tracemalloc
+
+# Revision before the resource and tag objects declared __slots__
+DEFAULT_BASELINE = 'e4b8b42^'
+
+
+class FakeStack(object):
+    """Just enough of the `Stack` interface for the resource objects"""
+
+    persistent_cache = None
+    write_through_tags = False
+    active_tag_writer = None
+
+    def get_cache_ttl(self, name, default):
+        return default
+
+
+def mk_resources(stack, nr_resources, nr_tags):
+    import cfalchemy.stack.ec2 as ec2
+
+    out = []
+    for idx in range(nr_resources):
+        obj = ec2.ECInstance(stack, 'i-{:017x}'.format(idx))
+        obj.prime_cache('describe', {
+            'InstanceId': obj.name,
+            # Keys are built at runtime, as they are when parsed from AWS responses
+            'Tags': [
+                {'Key': ''.join(['tag-', str(tag_idx)]), 'Value': 'value-{}'.format(tag_idx)}
+                for tag_idx in range(nr_tags)
+            ],
+        })
+        # Load the tags dict
+        assert len(obj.tags) == nr_tags
+        out.append(obj)
+    return out
+
+
+def measure(nr_resources, nr_tags):
+    """Return number of bytes allocated by `nr_resources` resource objects with loaded tags"""
+    stack = FakeStack()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    resources = mk_resources(stack, nr_resources, nr_tags)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    assert len(resources) == nr_resources
+    return used
+
+
+def measure_revision(revision, nr_resources, nr_tags):
+    """Return `measure()` result of the `cfalchemy` package at the git `revision`"""
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    archive = subprocess.check_output(['git', 'archive', revision, 'cfalchemy'], cwd=repo)
+    tmpdir = tempfile.mkdtemp(prefix='cfalchemy-baseline-')
+    try:
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            tar.extractall(tmpdir)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(el for el in (tmpdir, env.get('PYTHONPATH')) if el)
+        out = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--raw', str(nr_resources), str(nr_tags)],
+            cwd=tmpdir, env=env,
+        )
+    finally:
+        shutil.rmtree(tmpdir)
+    return int(out.strip())
+
+
+def report(label, used, nr_resources):
+    print('{:<20} {:8.1f} MiB ({:.0f} bytes per resource)'.format(
+        label, used / 2.0 ** 20, used / float(nr_resources),
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('nr_resources', nargs='?', type=int, default=10000)
+    parser.add_argument('nr_tags', nargs='?', type=int, default=20)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='git revision to compare with')
+    parser.add_argument('--raw', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    used = measure(args.nr_resources, args.nr_tags)
+    if args.raw:
+        print(used)
+        return
+    print('{} resources with {} tags each:'.format(args.nr_resources, args.nr_tags))
+    report('working tree', used, args.nr_resources)
+    if args.baseline:
+        baseline = measure_revision(args.baseline, args.nr_resources, args.nr_tags)
+        report(args.baseline, baseline, args.nr_resources)
+        print('{:<20} {:8.1f} MiB ({:+.1%})'.format(
+            'difference', (used - baseline) / 2.0 ** 20, (used - baseline) / float(baseline),
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,13 @@
 from .client import (  # noqa
-    client
+    aclient,
+    client,
+)
+from .client_pool import (  # noqa
+    ClientPool,
+)
+from .identity_map import (  # noqa
+    IdentityMap,
+)
+from .persistent_cache import (  # noqa
+    SqliteCache,
 )
@@ -0,0 +1,22 @@
+"""asyncio support
+
+boto3 calls are blocking, so the asynchronous (`a*`) methods of cfalchemy objects run them on an executor
+    and return asyncio futures that can be awaited without blocking the event loop.
+"""
+
+import functools
+
+# `concurrent.futures.Executor` the blocking calls are run on. `None` means the default executor of the event loop.
+executor = None
+
+
+def run_in_executor(func, *args, **kwargs):
+    """Return asyncio future of `func(*args, **kwargs)` running on the `executor`"""
+    import asyncio  # Not available on python 2
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+def get_attr(obj, name):
+    """Return asyncio future of `getattr(obj, name)`"""
+    return run_in_executor(getattr, obj, name)
@@ -1,10 +1,61 @@
 """Client module, represents logical session/connection"""
 
+import cfalchemy.aio
+import cfalchemy.client_pool
 import cfalchemy.resource_registry
+import cfalchemy.stack.unit_of_work
 
 
-def client(stack_name, **boto_kwargs):
-    """Open AWS stack connection"""
+def client(stack_name, client_pool=None, preload=None, cache_ttl=None, persistent_cache=None, identity_map=None,
+           write_through_tags=False, write_behind=None, poller=None, **boto_kwargs):
+    """Open AWS stack connection
+
+    boto3 clients are taken from the `client_pool` (`cfalchemy.client_pool.default_pool` if not provided),
+        so all stacks opened with the same AWS credentials share the same boto3 client objects.
+
+    `preload` eagerly loads the stack resources (along with their tags), see `Stack.load()`.
+        It can be either an iterable of resource types to load or `True` to load all supported resources.
+
+    `cache_ttl` is a {<cached property name>: <seconds>} dict that overrides how long cached properties
+        (e.g. 'describe') of the stack and its resources are kept before being re-fetched from AWS.
+
+    `persistent_cache` is a cache backend (e.g. `cfalchemy.persistent_cache.SqliteCache`) that stores
+        describe data of the stack and its resources on disk, so it can be reused by other processes.
+
+    `identity_map` is a `cfalchemy.identity_map.IdentityMap` object that holds resource objects of the stack
+        (e.g. `IdentityMap(lru_size=1000)` to keep 1000 most recently used objects alive).
+
+    If `write_through_tags` is set, tag writes update the cached tags and `describe` data of the resources
+        instead of purging their caches, so a tag update costs exactly one AWS call.
+
+    `write_behind` makes tag writes return immediately, they are written by a background thread
+        of the `cfalchemy.stack.unit_of_work.WriteBehindQueue` object passed (or created if `True`).
+        Use `stack.write_behind.flush()` when the writes have to be durable.
+
+    `poller` is a `cfalchemy.stack.waiter.Poller` that polls the resources awaited by `stack.wait_until()`,
+        pass the same object to several stacks to share its polling thread and batches.
+    """
+    if client_pool is None:
+        client_pool = cfalchemy.client_pool.default_pool
     registry = cfalchemy.resource_registry.CFAlchemyResourceRegistry()
     stack_cls = registry['AWS::CloudFormation::Stack']
-    return stack_cls(stack_name, registry, boto_kwargs=boto_kwargs)
+    if write_behind is True:
+        write_behind = cfalchemy.stack.unit_of_work.WriteBehindQueue()
+    stack = stack_cls(
+        stack_name, registry, boto_kwargs=boto_kwargs,
+        client_pool=client_pool, cache_ttl=cache_ttl, persistent_cache=persistent_cache,
+        identity_map=identity_map, write_through_tags=write_through_tags, write_behind=write_behind,
+        poller=poller,
+    )
+    if preload:
+        stack.load(types=None if preload is True else preload, with_tags=True)
+    return stack
+
+
+def aclient(stack_name, **kwargs):
+    """Return asyncio future of `client(stack_name, **kwargs)`.
+
+    Methods of the stack and its resources prefixed with 'a' (e.g. `aresources()`, `adescribe()`)
+        return asyncio futures as well, see `cfalchemy.aio`.
+    """
+    return cfalchemy.aio.run_in_executor(client, stack_name, **kwargs)
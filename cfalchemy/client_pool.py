@@ -0,0 +1,67 @@
+"""Pool of boto3 clients shared between stacks and their resources"""
+
+import threading
+
+import boto3
+import botocore.config
+
+
+class ClientPool(object):
+    """Thread-safe cache of boto3 client objects.
+
+    Clients are keyed by the service name and the boto3 session arguments (region, credentials, ...),
+    so each distinct (service, region, credentials) combination results in exactly one client object.
+
+    'max_pool_connections' is passed to the botocore config of every client created by this pool.
+    """
+
+    def __init__(self, max_pool_connections=10):
+        self.max_pool_connections = max_pool_connections
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, service_name, **boto_kwargs):
+        """Return boto3 client for the service, creating one if it doesn't exist yet."""
+        key = self._mk_key(service_name, boto_kwargs)
+        try:
+            return self._clients[key]
+        except KeyError:
+            pass
+
+        with self._lock:
+            # Some other thread might have created the client while this one was waiting for the lock
+            if key not in self._clients:
+                self._clients[key] = self._create_client(service_name, boto_kwargs)
+            return self._clients[key]
+
+    def clear(self):
+        """Drop all pooled clients"""
+        with self._lock:
+            self._clients.clear()
+
+    def _create_client(self, service_name, boto_kwargs):
+        kwargs = dict(boto_kwargs)
+        config = botocore.config.Config(max_pool_connections=self.max_pool_connections)
+        if kwargs.get('config') is not None:
+            # User-provided config takes priority
+            config = config.merge(kwargs['config'])
+        kwargs['config'] = config
+        return boto3.client(service_name, **kwargs)
+
+    @staticmethod
+    def _mk_key(service_name, boto_kwargs):
+        return (service_name, tuple(sorted(boto_kwargs.items())))
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __repr__(self):
+        return '<{}.{} clients={}>'.format(
+            self.__module__,
+            self.__class__.__name__,
+            [key[0] for key in self._clients],
+        )
+
+
+# Pool shared by all `cfalchemy.client()` calls that do not provide their own
+default_pool = ClientPool()
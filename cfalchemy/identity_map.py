@@ -0,0 +1,67 @@
+"""Identity map ensures that there is only one object per AWS resource"""
+
+import collections
+import threading
+import weakref
+
+
+class IdentityMap(object):
+    """Registry of resource objects keyed by (<resource class>, <resource name>).
+
+    Objects are referenced weakly, so they are dropped once nothing else uses them.
+        If `lru_size` is set, that many most recently used objects are also kept alive by the map itself.
+    """
+
+    def __init__(self, lru_size=None):
+        self.lru_size = lru_size
+        self._objects = weakref.WeakValueDictionary()
+        self._lru = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, cls, name, factory):
+        """Return object registered for (cls, name), registering `factory()` if there is none."""
+        key = (cls, name)
+        with self._lock:
+            obj = self._objects.get(key)
+            if obj is None:
+                obj = factory()
+                self._objects[key] = obj
+            self._touch(key, obj)
+        return obj
+
+    def get(self, cls, name, default=None):
+        return self._objects.get((cls, name), default)
+
+    def objects(self, cls=None):
+        """Return list of the live objects registered for the resource class `cls` (or of all objects if None)"""
+        with self._lock:
+            items = list(self._objects.items())
+        return [obj for ((key_cls, _), obj) in items if cls is None or key_cls is cls]
+
+    def discard(self, cls, name):
+        key = (cls, name)
+        with self._lock:
+            self._objects.pop(key, None)
+            self._lru.pop(key, None)
+
+    def _touch(self, key, obj):
+        if not self.lru_size:
+            return
+        self._lru.pop(key, None)
+        self._lru[key] = obj
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._objects
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __repr__(self):
+        return '<{}.{} objects={} lru_size={}>'.format(
+            self.__module__,
+            self.__class__.__name__,
+            len(self),
+            self.lru_size,
+        )
@@ -0,0 +1,86 @@
+"""Persistent (on-disk) cache for AWS describe responses shared between processes"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from six.moves import cPickle as pickle
+
+log = logging.getLogger(__name__)
+
+
+class SqliteCache(object):
+    """Cache backed by an SQLite database file in `directory`.
+
+    Values are pickled, so the cache file has to be writeable only by the trusted users.
+    Entries older than `max_age` seconds are ignored (`None` means that entries never expire).
+    SQLite errors (e.g. locked or corrupt database file) are logged and the cache acts as if it was empty,
+        so the values are loaded from AWS instead.
+    """
+
+    PICKLE_PROTOCOL = 2
+
+    def __init__(self, directory, max_age=3600, filename='cfalchemy-cache.sqlite3'):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = os.path.join(directory, filename)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            '  key TEXT PRIMARY KEY,'
+            '  stored_at REAL NOT NULL,'
+            '  value BLOB NOT NULL'
+            ')'
+        )
+
+    def get(self, key, max_age=None, not_before=None):
+        """Return value stored under the `key`.
+
+        Raises KeyError if there is no such value or it is older than `max_age` (or the cache-wide `max_age`)
+            or stored before `not_before` timestamp.
+        """
+        with self._lock:
+            try:
+                row = self._conn.execute('SELECT stored_at, value FROM cache WHERE key = ?', (key, )).fetchone()
+            except sqlite3.Error:
+                log.exception('Reading {!r} from {!r} failed'.format(key, self))
+                row = None
+        if row is None:
+            raise KeyError(key)
+        (stored_at, value) = row
+        now = time.time()
+        for age_limit in (max_age, self.max_age):
+            if age_limit is not None and stored_at + age_limit <= now:
+                raise KeyError(key)
+        if not_before is not None and stored_at < not_before:
+            raise KeyError(key)
+        return pickle.loads(bytes(value))
+
+    def set(self, key, value):
+        data = pickle.dumps(value, self.PICKLE_PROTOCOL)
+        self._execute(
+            'INSERT OR REPLACE INTO cache (key, stored_at, value) VALUES (?, ?, ?)',
+            (key, time.time(), sqlite3.Binary(data))
+        )
+
+    def delete(self, key):
+        self._execute('DELETE FROM cache WHERE key = ?', (key, ))
+
+    def clear(self):
+        self._execute('DELETE FROM cache')
+
+    def _execute(self, sql, params=()):
+        """Execute the modifying statement in a transaction, SQLite errors are logged and ignored"""
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.execute(sql, params)
+            except sqlite3.Error:
+                log.exception('Statement {!r} of {!r} failed'.format(sql, self))
+
+    def __repr__(self):
+        return '<{}.{} path={!r}>'.format(self.__module__, self.__class__.__name__, self.path)
@@ -1,6 +1,7 @@
 """This module contains objective mappings of AWS stacks"""
 
 from . import (  # noqa
+    query,
     cloud_formation,
     rds,
     ec2,
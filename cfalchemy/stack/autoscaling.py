@@ -1,3 +1,4 @@
+import collections
 from enum import Enum
 from cached_property import cached_property
 
@@ -35,17 +36,55 @@ class AutoScalingInstance(object):
 
     @cached_property
     def instance(self):
-        return ec2.ECInstance(self._parent.stack, self.instance_id)
+        try:
+            return self._parent._instance_objects[self.instance_id]
+        except KeyError:
+            # Not a member of the group anymore
+            return self._parent.stack.resource_object(ec2.ECInstance, self.instance_id)
 
 
 class AutoScalingGroup(base.StackResource):
 
+    __slots__ = ()
+
     resource_type = 'AWS::AutoScaling::AutoScalingGroup'
     boto_service_name = 'autoscaling'
 
-    @base.Base.cached_property
+    describe_batch_size = 50
+    lifecycle_cached_properties = ('describe', '_instance_objects')
+    # Tags of all groups are sent in one list, so keep the requests reasonably small
+    tag_batch_size = 20
+
+    @classmethod
+    def describe_many(cls, conn, names):
+        out = {}
+        paginator = conn.get_paginator('describe_auto_scaling_groups')
+        for page in paginator.paginate(AutoScalingGroupNames=list(names)):
+            for group in page['AutoScalingGroups']:
+                out[group['AutoScalingGroupName']] = group
+        return out
+
+    @classmethod
+    def write_tags_many(cls, conn, writes):
+        for chunk in base.iter_chunks(writes, cls.tag_batch_size):
+            to_set = [
+                _asg_tag(name, el)
+                for (name, tags, _) in chunk
+                for el in tags
+            ]
+            if to_set:
+                conn.create_or_update_tags(Tags=to_set)
+            to_delete = [
+                _asg_tag(name, {'Key': el['Key']})
+                for (name, _, tags) in chunk
+                for el in tags
+            ]
+            if to_delete:
+                conn.delete_tags(Tags=to_delete)
+
+    @base.Base.cached_property(persistent=True)
     def describe(self):
-        return self.conn.describe_auto_scaling_groups(AutoScalingGroupNames=[self.name])['AutoScalingGroups'][0]
+        return self.describe_with_siblings()
 
     @base.Base.cached_property
     def arn(self):
@@ -62,6 +101,20 @@ class AutoScalingGroup(base.StackResource):
             for el in self.describe['Instances']
         )
 
+    def load_instances(self):
+        """Return tuple of `ECInstance` objects of the group members"""
+        return tuple(self._instance_objects.values())
+
+    @base.Base.cached_property
+    def _instance_objects(self):
+        """{<instance id>: <ECInstance>} of the group members, described with batched calls"""
+        out = collections.OrderedDict(
+            (el['InstanceId'], self.stack.resource_object(ec2.ECInstance, el['InstanceId']))
+            for el in self.describe['Instances']
+        )
+        ec2.ECInstance.load_many(out.values())
+        return out
+
     @property
     def min_size(self):
         return self.describe['MinSize']
@@ -74,6 +127,15 @@ class AutoScalingGroup(base.StackResource):
     def desired_capacity(self):
         return self.describe['DesiredCapacity']
 
+    @property
+    def converged(self):
+        """True if the group has exactly `desired_capacity` healthy in-service instances"""
+        return len(self.instances) == self.desired_capacity and all(
+            el.lifecycle_state == AutoScalingInstanceStates.InService
+            and el.health_status == AutoScalingInstanceHealth.Healthy
+            for el in self.instances
+        )
+
     def update(self, **params):
         self.conn.update_auto_scaling_group(
             AutoScalingGroupName=self.name,
@@ -105,4 +167,13 @@ class AutoScalingGroup(base.StackResource):
                 ]
             ),
             on_cache_purged=lambda: self.clear_cache(),
+            write_through=self.write_through_tags,
+            on_committed=self._update_described_tags,
+            committer=self._tag_committer,
         )
+
+
+def _asg_tag(name, tag):
+    out = tag.copy()
+    out.update(ResourceId=name, ResourceType='auto-scaling-group')
+    return out
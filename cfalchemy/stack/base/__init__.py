@@ -1,6 +1,8 @@
 from .base import (  # noqa
     Base,
+    CachedProperty,
     StackResource,
+    iter_chunks,
 )
 
 from .aws_dict import (   # noqa
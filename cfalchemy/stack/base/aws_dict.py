@@ -1,20 +1,44 @@
 import collections
 import contextlib
+import itertools
 import threading
 import logging
 import six
+from frozendict import frozendict
+
+from ... import aio
 
 log = logging.getLogger(__name__)
 
+# Shared by all dicts: it guards rare deferred commit updates only
+_deferred_lock = threading.Lock()
+# Guards lazy creation of the thread-local states
+_thread_state_lock = threading.Lock()
+_NO_UPDATES = frozendict()
+
+
+def _intern(name):
+    """Intern string `name`, so the same tag keys of many resources share one string object"""
+    if isinstance(name, str):
+        return six.moves.intern(name)
+    return name
+
+
+# Keys written by `AwsAdvancedDict.commit_update()`.
+#   'unchanged' are the keys that were not written as AWS already had the requested values.
+CommitSummary = collections.namedtuple('CommitSummary', ['updated', 'deleted', 'unchanged'])
+
 
 class AwsItem(collections.MutableMapping):
     """AWS item record"""
 
-    def __init__(self, parent_aws, my_key, prop_values):
+    __slots__ = ('data', 'key', '_parent_aws', '_no_propagate')
+
+    def __init__(self, parent_aws, my_key, prop_values, copy_values=True):
         super(AwsItem, self).__init__()
         assert isinstance(my_key, six.string_types)
         assert isinstance(prop_values, dict)
-        self.data = prop_values.copy()
+        self.data = prop_values.copy() if copy_values else prop_values
         self.key = my_key
         self._parent_aws = parent_aws
         self._no_propagate = 0
@@ -78,14 +102,22 @@ class AwsAdvancedDict(collections.MutableMapping):
 
         'on_cache_purged' is a function that is called when this object modifies underlying resource state
             and purges its own cache.
+
+        If 'write_through' is set, committed changes are applied to the cached items instead of purging them,
+            and 'on_committed' is called with the list of the updated raw items (as returned by the getter).
+
+        'committer' is a function returning None if commits are to be written immediately, or a function
+            the commit is deferred to (e.g. `UnitOfWork.defer()`). The deferred function is called with this object
+            and is expected to write `take_deferred()` changes later. Reads see the deferred changes meanwhile.
     """
 
-    # This object will contain:
-    #  'updates' list of pending updates dicts
-    #       idx 0 = top fo the stack
-    dict_thread_stacks = None
+    __slots__ = (
+        'key_name', '_getter_fn', '_setter_fn', '_deleter_fn', '_on_cache_purged', 'write_through', '_on_committed',
+        '_committer', '_deferred', '_thread_state', '_remote_item_cache',
+    )
 
-    def __init__(self, key_name, getter, setter=None, deleter=None, on_cache_purged=None):
+    def __init__(self, key_name, getter, setter=None, deleter=None, on_cache_purged=None, write_through=False,
+                 on_committed=None, committer=None):
         assert isinstance(key_name, str)
         self.key_name = key_name
         assert callable(getter)
@@ -93,8 +125,15 @@ class AwsAdvancedDict(collections.MutableMapping):
         self._setter_fn = setter
         self._deleter_fn = deleter
         self._on_cache_purged = on_cache_purged
-        self.dict_thread_stacks = threading.local()
-        self._mutex = threading.Lock()
+        self.write_through = write_through
+        self._on_committed = on_committed
+        self._committer = committer
+        # {<key>: <AwsItem or None if deleted>} of the commits deferred to the committer.
+        #   It is replaced rather than modified, so the readers don't need a lock.
+        self._deferred = _NO_UPDATES
+        # Thread-local state, created on the first update
+        self._thread_state = None
+        self._remote_item_cache = None
 
     def setter(self, new_setter):
         assert callable(new_setter)
@@ -114,17 +153,48 @@ class AwsAdvancedDict(collections.MutableMapping):
     def __delitem__(self, key):
         self.update(**{key: None})
 
+    # Reads look the key up in the pending update layers (newest first), deferred commits and then in the remote
+    #   item cache, so no copy of the dict is made. Use `current_items_view` to get a snapshot.
+
     def __getitem__(self, key):
-        return self.current_items_view[key]
+        for layer in itertools.chain(reversed(self._my_update_layers()), (self._deferred, )):
+            if key in layer:
+                value = layer[key]
+                if value is None:
+                    # Pending deletion
+                    raise KeyError(key)
+                return value
+        return self._get_remote_item_cache()[key]
 
     def __len__(self):
-        return len(self.current_items_view)
+        remote = self._get_remote_item_cache()
+        if not (self._my_update_layers() or self._deferred):
+            return len(remote)
+        out = len(remote)
+        for (name, value) in self.pending_updates.items():
+            out += (value is not None) - (name in remote)
+        return out
 
     def __iter__(self):
-        return iter(self.current_items_view)
+        remote = self._get_remote_item_cache()
+        if not (self._my_update_layers() or self._deferred):
+            return iter(remote)
+        return self._iter_with_pending(remote, self.pending_updates)
+
+    def _iter_with_pending(self, remote, pending):
+        for name in remote:
+            if name not in pending:
+                yield name
+        for (name, value) in pending.items():
+            if value is not None:
+                yield name
 
     def update(self, **params):
-        """Update the dictionary. Updating value to 'None' causes for it to be deleted"""
+        """Update the dictionary. Updating value to 'None' causes for it to be deleted
+
+        Returns `CommitSummary` if the update was committed (i.e. it wasn't a part of outer `bulk_update()`)
+        """
+        is_outermost = not self.my_updates
         with self.bulk_update():
             aws_params = {}
             for (name, value) in params.items():
@@ -134,6 +204,8 @@ class AwsAdvancedDict(collections.MutableMapping):
                     value = self._mk_aws_item(value)
                 aws_params[name] = value
             self.my_updates[-1].update(aws_params)
+        if is_outermost:
+            return self.last_commit
 
     @contextlib.contextmanager
     def bulk_update(self):
@@ -156,29 +228,135 @@ class AwsAdvancedDict(collections.MutableMapping):
                 self.commit_update(my_el)
 
     def commit_update(self, data_dict):
+        """Write the updates to AWS. Updates that match the remote items already are skipped.
+
+        Returns `CommitSummary` (it is also available as `last_commit` afterwards).
+        """
+        remote = self._get_remote_item_cache()
+        changes = {}
+        unchanged = []
+        for (name, value) in data_dict.items():
+            # Compare against what AWS will have after the deferred commits are written
+            current = self._deferred.get(name) if name in self._deferred else remote.get(name)
+            if value is None and current is None:
+                unchanged.append(name)
+            elif value is not None and current is not None and current.data == value.data:
+                unchanged.append(name)
+            else:
+                changes[name] = value
+        (to_set, to_delete) = self._api_changes(changes)
+        if to_set and not self._setter_fn:
+            raise NotImplementedError('You must provide "setter" to update dict elements.')
+        if to_delete and not self._deleter_fn:
+            raise NotImplementedError('You must provide "delete" to delete elements')
+
+        defer_fn = self._committer() if (changes and self._committer) else None
+        if defer_fn is None:
+            self.write(to_set, to_delete)
+        else:
+            with _deferred_lock:
+                deferred = dict(self._deferred)
+                deferred.update(changes)
+                self._deferred = deferred
+            defer_fn(self)
+        summary = CommitSummary(
+            tuple(sorted(el[self.key_name] for el in to_set)),
+            tuple(sorted(el[self.key_name] for el in to_delete)),
+            tuple(sorted(unchanged)),
+        )
+        self.dict_thread_stacks.last_commit = summary
+        if defer_fn is None:
+            self._update_cache(to_set, to_delete)
+        return summary
+
+    def write(self, to_set, to_delete):
+        """Write lists of the items to set/delete with the setter and deleter"""
+        if to_set:
+            self._setter_fn(to_set)
+        if to_delete:
+            self._deleter_fn(to_delete)
+
+    def _api_changes(self, changes):
+        """Convert {<key>: <AwsItem or None>} dict to (<list of items to set>, <list of items to delete>)"""
         to_set = []
         to_delete = []
-        for (name, value) in data_dict.items():
+        for (name, value) in changes.items():
             api_el = {self.key_name: name}
             if value is None:
                 to_delete.append(api_el)
             else:
                 api_el.update(value.data)
                 to_set.append(api_el)
-        if to_set and not self._setter_fn:
-            raise NotImplementedError('You must provide "setter" to update dict elements.')
-        elif to_set:
-            self._setter_fn(to_set)
+        return (to_set, to_delete)
 
-        if to_delete and not self._deleter_fn:
-            raise NotImplementedError('You must provide "delete" to delete elements')
-        elif to_delete:
-            self._deleter_fn(to_delete)
+    def take_deferred(self):
+        """Return (<snapshot>, <list of items to set>, <list of items to delete>) of the deferred commits.
+
+        The snapshot has to be passed to `deferred_written()` or `deferred_failed()` once the writes are done.
+        """
+        snapshot = dict(self._deferred)
+        return (snapshot, ) + self._api_changes(snapshot)
+
+    def deferred_written(self, snapshot):
+        """Mark the deferred changes of the snapshot as written to AWS"""
+        self.drop_deferred(snapshot)
+        (to_set, to_delete) = self._api_changes(snapshot)
+        self._update_cache(to_set, to_delete)
+
+    def deferred_failed(self, snapshot):
+        """Drop the deferred changes that failed to be written. The cache is purged, as AWS state is not known."""
+        self.drop_deferred(snapshot)
         del self.remote_items
 
+    @property
+    def has_deferred(self):
+        """True if there are deferred commits that aren't written yet"""
+        return bool(self._deferred)
+
+    def drop_deferred(self, snapshot):
+        """Forget the deferred changes of the snapshot (without writing them)"""
+        with _deferred_lock:
+            deferred = dict(self._deferred)
+            for (name, value) in snapshot.items():
+                # The key might have been updated again since the snapshot was taken
+                if name in deferred and deferred[name] is value:
+                    del deferred[name]
+            self._deferred = deferred or _NO_UPDATES
+
+    def _update_cache(self, to_set, to_delete):
+        if not (to_set or to_delete):
+            return
+        if self.write_through:
+            self._write_through(self._get_remote_item_cache(), to_set, to_delete)
+        else:
+            del self.remote_items
+
+    def _write_through(self, remote, to_set, to_delete):
+        # The cache is replaced rather than modified, so the readers iterating over the old one are not affected
+        new_cache = remote.copy()
+        for api_el in to_set:
+            item = self._mk_aws_item(api_el)
+            new_cache[item.key] = item
+        for api_el in to_delete:
+            new_cache.pop(api_el[self.key_name], None)
+        self._remote_item_cache = new_cache
+        if callable(self._on_committed):
+            raw_items = []
+            for item in new_cache.values():
+                raw = item.data.copy()
+                raw[self.key_name] = item.key
+                raw_items.append(raw)
+            self._on_committed(raw_items)
+
+    @property
+    def last_commit(self):
+        """`CommitSummary` of the last commit made by the current thread (None if there was none)"""
+        return getattr(self._thread_state, 'last_commit', None)
+
     @property
     def current_items_view(self):
-        out = self.remote_items.copy()
+        """Snapshot {<key>: <AwsItem>} dict of the remote items with pending updates applied"""
+        out = self.remote_items
         if self.pending_updates:
             for (name, value) in self.pending_updates.items():
                 if value is None:
@@ -189,12 +367,26 @@ class AwsAdvancedDict(collections.MutableMapping):
 
     @property
     def pending_updates(self):
-        out = {}
-        for layer in self.my_updates:
+        """{<key>: <AwsItem or None if deleted>} of deferred and current thread's uncommitted updates"""
+        out = dict(self._deferred)
+        for layer in self._my_update_layers():
             # Iter iterates from idx 0 (oldest) to idx -1 (newest)
             out.update(layer)
         return out
 
+    @property
+    def dict_thread_stacks(self):
+        """Thread-local state. It will contain:
+
+            'updates' list of pending updates dicts (idx 0 = top fo the stack)
+            'last_commit' `CommitSummary` of the last commit
+        """
+        if self._thread_state is None:
+            with _thread_state_lock:
+                if self._thread_state is None:
+                    self._thread_state = threading.local()
+        return self._thread_state
+
     @property
     def my_updates(self):
         try:
@@ -204,17 +396,38 @@ class AwsAdvancedDict(collections.MutableMapping):
 
         return self.dict_thread_stacks.updates
 
-    _remote_item_cache = None
+    def _my_update_layers(self):
+        """Return pending update layers of the current thread without allocating the thread state"""
+        return getattr(self._thread_state, 'updates', ())
 
     @property
     def remote_items(self):
+        return self._get_remote_item_cache().copy()
+
+    def _get_remote_item_cache(self):
         if self._remote_item_cache is None:
             _remote_item_cache = {}
             for el in self._getter_fn():
                 item_el = self._mk_aws_item(el)
                 _remote_item_cache[item_el.key] = item_el
             self._remote_item_cache = _remote_item_cache
-        return self._remote_item_cache.copy()
+        return self._remote_item_cache
+
+    def prefetch(self):
+        """Load remote items now instead of on the first access"""
+        self._get_remote_item_cache()
+
+    def aprefetch(self):
+        """Return asyncio future of `prefetch()`. Reads of the prefetched dict don't call AWS."""
+        return aio.run_in_executor(self.prefetch)
+
+    def acommit(self, updates):
+        """Return asyncio future of applying {<key>: <value dict or None to delete>} `updates` in one commit"""
+        return aio.run_in_executor(self.update, **updates)
+
+    def forget_remote_items(self):
+        """Drop the cached remote items without calling `on_cache_purged`, they are read again on the next access"""
+        self._remote_item_cache = None
 
     @remote_items.deleter
     def remote_items(self):
@@ -230,12 +443,12 @@ class AwsAdvancedDict(collections.MutableMapping):
         key = None
         for (name, value) in raw_data.items():
             if name == self.key_name:
-                key = value
+                key = _intern(value)
             else:
-                data[name] = value
+                data[_intern(name)] = value
 
         assert key is not None, "Key has to be present"
-        return AwsItem(self, key, data)
+        return AwsItem(self, key, data, copy_values=False)
 
     def __repr__(self):
         return "<{}.{} vals={}>".format(
@@ -255,9 +468,15 @@ class AwsDict(collections.MutableMapping):
     if needed.
     """
 
-    def __init__(self, key_name, value_name, getter, setter=None, deleter=None, on_cache_purged=None):
+    __slots__ = ('value_key', 'full')
+
+    def __init__(self, key_name, value_name, getter, setter=None, deleter=None, on_cache_purged=None,
+                 write_through=False, on_committed=None, committer=None):
         self.value_key = value_name
-        self.full = AwsAdvancedDict(key_name, getter, setter, deleter, on_cache_purged)
+        self.full = AwsAdvancedDict(
+            key_name, getter, setter, deleter, on_cache_purged,
+            write_through=write_through, on_committed=on_committed, committer=committer,
+        )
 
     def setter(self, fn):
         return self.full.setter(fn)
@@ -290,6 +509,36 @@ class AwsDict(collections.MutableMapping):
     def bulk_update(self):
         return self.full.bulk_update()
 
+    @property
+    def last_commit(self):
+        return self.full.last_commit
+
+    @property
+    def has_deferred(self):
+        return self.full.has_deferred
+
+    def forget_remote_items(self):
+        return self.full.forget_remote_items()
+
+    def prefetch(self):
+        return self.full.prefetch()
+
+    def aprefetch(self):
+        return self.full.aprefetch()
+
+    def acommit(self, updates):
+        """Return asyncio future of applying {<key>: <value or None to delete>} `updates` in one commit"""
+        return aio.run_in_executor(self._commit, updates)
+
+    def _commit(self, updates):
+        with self.bulk_update():
+            for (key, value) in updates.items():
+                if value is None:
+                    del self[key]
+                else:
+                    self[key] = value
+        return self.last_commit
+
     def __repr__(self):
         return "<{}.{} content={}>".format(
             self.__class__.__module__, self.__class__.__name__,
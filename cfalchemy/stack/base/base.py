@@ -3,22 +3,167 @@ from abc import ABCMeta, abstractproperty
 
 import logging
 import functools
+import itertools
+import sys
 import threading
-from cached_property import cached_property as orig_cached_prop
+import time
+from enum import Enum
+import botocore.exceptions
+import six
+
+from ... import aio
+from . import aws_dict as cf_aws_dict
 
 log = logging.getLogger(__name__)
 
+# Clock used to expire cached properties
+monotonic = getattr(time, 'monotonic', time.time)
+
+# Locks shared by `Base` objects (picked by object id), so the objects don't allocate a lock each.
+#   They guard short cache dict operations only and are never held while acquiring another one.
+_LOCK_STRIPES = tuple(threading.Lock() for _ in range(64))
+
+# Suffixes of the codes of AWS errors caused by unknown resource ids (e.g. 'InvalidInstanceID.NotFound')
+_NOT_FOUND_ERRORS = ('NotFound', '.Malformed')
+
+
+def _keep_dropped(value):
+    """Return True if the cached `value` being dropped has to be kept, as it holds changes not written to AWS yet.
+
+    That's the case of the tag dicts with deferred commits: they are kept (so the reads still see the commits),
+        only their copy of the AWS state is dropped.
+    """
+    if not isinstance(value, (cf_aws_dict.AwsAdvancedDict, cf_aws_dict.AwsDict)) or not value.has_deferred:
+        return False
+    value.forget_remote_items()
+    return True
+
+
+def iter_chunks(iterable, size):
+    """Split the iterable into tuples of at most `size` elements"""
+    iterator = iter(iterable)
+    while True:
+        chunk = tuple(itertools.islice(iterator, size))
+        if not chunk:
+            break
+        yield chunk
+
+
+class CachedProperty(object):
+    """Property that caches its value in the `Base` object.
+
+    The value is re-computed on access once `ttl` seconds have passed since it was cached
+        (`None` ttl means that the value is cached until the cache is cleared).
+
+    Values of `persistent` properties are also stored in the persistent cache of the object (if it has one)
+        and looked up there before the value is computed.
+
+    Concurrent loads of the same property of the same object are coalesced: only one thread computes the value,
+        the others wait for it and share its result (or exception).
+    """
+
+    def __init__(self, func, ttl=None, persistent=False):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.name = func.__name__
+        self.ttl = ttl
+        self.persistent = persistent
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        with obj._lock:
+            try:
+                return obj._get_cached_locked(self.name)
+            except KeyError:
+                pass
+            (flight, is_leader) = obj._join_flight_locked(self.name)
+
+        if not is_leader:
+            return flight.wait()
+
+        try:
+            (value, from_persistent) = self._load(obj)
+        except BaseException:
+            # Waiters are released on any error (including KeyboardInterrupt), otherwise they would hang forever
+            obj._end_flight(self.name, flight, exc_info=sys.exc_info())
+            raise
+        # Only successfully computed values are cached
+        obj._store_cached(self.name, value, generation=flight.generation)
+        if self.persistent and not from_persistent:
+            obj._save_persistent(self.name, value)
+        obj._end_flight(self.name, flight, value=value)
+        return value
+
+    def _load(self, obj):
+        """Return (<value>, <True if the value was loaded from the persistent cache>)"""
+        if self.persistent:
+            try:
+                return (obj._load_persistent(self.name), True)
+            except KeyError:
+                pass
+        return (self.func(obj), False)
+
+    def __set__(self, obj, value):
+        raise AttributeError('Cached property {!r} is read-only'.format(self.name))
+
+    def __delete__(self, obj):
+        obj.invalidate(self.name)
+
+
+class _Flight(object):
+    """In-flight load of a cached property value shared by all threads requesting it"""
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.thread_id = threading.current_thread().ident
+        self._done = threading.Event()
+        self._value = None
+        self._exc_info = None
+
+    def resolve(self, value=None, exc_info=None):
+        self._value = value
+        self._exc_info = exc_info
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._exc_info is not None:
+            six.reraise(*self._exc_info)
+        return self._value
+
 
 class Base(object):
     __metaclass__ = ABCMeta
 
+    # There is an object per AWS resource, so keep them compact.
+    #   _cache: {<cached property name>: (<value>, <expiry time or None>)}, None if nothing is cached
+    #   _invalidated_at: wall clock time of the last cache invalidation, older persistent cache entries are ignored
+    #   _cache_generation: incremented on every invalidation, so values loaded before it are not cached
+    #   _flights: {<cached property name>: <_Flight>} of the values being loaded, None if there are none
+    __slots__ = ('_cache', '_invalidated_at', '_cache_generation', '_flights', '__weakref__')
+
     resource_type = "<Override with AWS resource type>"
-    _cached_properties = None
-    _lock = None
+    # Persistent cache backend (e.g. `cfalchemy.persistent_cache.SqliteCache`)
+    persistent_cache = None
 
     def __init__(self):
-        self._lock = threading.Lock()
-        self._cached_properties = set()
+        self._cache = None
+        self._invalidated_at = None
+        self._cache_generation = 0
+        self._flights = None
+
+    @property
+    def _lock(self):
+        return _LOCK_STRIPES[(id(self) >> 4) % len(_LOCK_STRIPES)]
+
+    @property
+    def _cached_properties(self):
+        """{<cached property name>: <expiry time or None>} of the cached values"""
+        return dict(
+            (name, expires)
+            for (name, (_, expires)) in (self._cache or {}).items()
+        )
 
     @abstractproperty
     def cfalchemy_uuid(self):
@@ -42,34 +187,150 @@ class Base(object):
         )
 
     def clear_cache(self):
-        """Delete all cached data, forcing re-sync with the AWS"""
+        """Delete all cached data, forcing re-sync with the AWS. Commits deferred to a unit of work are kept."""
         with self._lock:
-            for name in self._cached_properties:
-                self.__dict__.pop(name, None)
-            self._cached_properties.clear()
+            self._invalidated_at = time.time()
+            self._cache_generation += 1
+            kept = dict((name, entry) for (name, entry) in (self._cache or {}).items() if _keep_dropped(entry[0]))
+            self._cache = kept or None
 
-    @staticmethod
-    def cached_property(func):
-        """Same as `cached_property.cached_property decorator`
+    def invalidate(self, *names):
+        """Delete cached values of the named cached properties"""
+        with self._lock:
+            self._invalidated_at = time.time()
+            self._cache_generation += 1
+            if self._cache is not None:
+                for name in names:
+                    entry = self._cache.get(name)
+                    if entry is not None and not _keep_dropped(entry[0]):
+                        del self._cache[name]
 
-        But also updates an index of cached properties in this object so all of them can be nullified when needed.
-        """
+    def is_cached(self, name):
+        """Return True if the cached property `name` holds a value that hasn't expired yet"""
+        try:
+            self._get_cached(name)
+        except KeyError:
+            return False
+        return True
+
+    def aget(self, name):
+        """Return asyncio future of the attribute `name` loaded without blocking the event loop"""
+        return aio.get_attr(self, name)
+
+    def prime_cache(self, name, value):
+        """Store `value` as the value of cached property `name` (as if it was loaded from the AWS)"""
+        self._store_cached(name, value)
+        if getattr(getattr(self.__class__, name, None), 'persistent', False):
+            self._save_persistent(name, value)
+
+    def get_cache_ttl(self, name, default):
+        """Return TTL (in seconds) of the cached property `name`. `default` is the TTL declared on the property."""
+        return default
+
+    def persistent_cache_key(self, name):
+        """Return key of the property `name` in the persistent cache (None if the value can't be persisted)"""
+        return None
+
+    def _get_ttl(self, name):
+        prop = getattr(self.__class__, name, None)
+        return self.get_cache_ttl(name, getattr(prop, 'ttl', None))
+
+    def _expiry(self, name):
+        """Return monotonic time the value of `name` cached now expires at (None if it never expires)"""
+        ttl = self._get_ttl(name)
+        return None if ttl is None else monotonic() + ttl
 
-        @orig_cached_prop
-        @functools.wraps(func)
-        def _wrapper_(self):
-            out = func(self)
-            # Update list of cached properties (if prev statement didn't raise an exceptiopn)
-            with self._lock:
-                self._cached_properties.add(func.__name__)
-            return out
+    def _store_cached(self, name, value, generation=None):
+        """Cache the value. It is discarded if the cache was invalidated since `generation`."""
+        expires = self._expiry(name)
+        with self._lock:
+            if generation is not None and generation != self._cache_generation:
+                return
+            if self._cache is None:
+                self._cache = {}
+            self._cache[name] = (value, expires)
+
+    def _load_persistent(self, name):
+        """Return value of `name` from the persistent cache. Raises KeyError if there is no usable value."""
+        cache = self.persistent_cache
+        key = None if cache is None else self.persistent_cache_key(name)
+        if key is None:
+            raise KeyError(name)
+        max_age = self._get_ttl(name)
+        value = cache.get(key, max_age=max_age, not_before=self._invalidated_at)
+        self._loaded_from_persistent(max_age)
+        return value
+
+    def _loaded_from_persistent(self, max_age):
+        """Called once a value at most `max_age` seconds old (None if unlimited) was loaded from the persistent cache"""
+
+    def _save_persistent(self, name, value):
+        cache = self.persistent_cache
+        key = None if cache is None else self.persistent_cache_key(name)
+        if key is not None:
+            cache.set(key, value)
+
+    def _delete_persistent(self, name):
+        cache = self.persistent_cache
+        key = None if cache is None else self.persistent_cache_key(name)
+        if key is not None:
+            cache.delete(key)
+
+    def _get_cached(self, name):
+        """Return cached value of the property, raises KeyError if there is none or it has expired."""
+        with self._lock:
+            return self._get_cached_locked(name)
+
+    def _get_cached_locked(self, name):
+        if self._cache is None:
+            raise KeyError(name)
+        (value, expires) = self._cache[name]
+        if expires is not None and expires <= monotonic() and not _keep_dropped(value):
+            del self._cache[name]
+            raise KeyError(name)
+        return value
+
+    def _join_flight_locked(self, name):
+        """Return (<flight loading the property>, <True if the current thread has to load the value>)"""
+        if self._flights is None:
+            self._flights = {}
+        flight = self._flights.get(name)
+        if (
+            flight is not None
+            and flight.thread_id != threading.current_thread().ident
+            and flight.generation == self._cache_generation
+        ):
+            return (flight, False)
+        # Nobody is loading the value, the load started before the cache was invalidated
+        #   (so its value may be stale) or this thread is loading it recursively
+        flight = _Flight(self._cache_generation)
+        self._flights[name] = flight
+        return (flight, True)
+
+    def _end_flight(self, name, flight, value=None, exc_info=None):
+        with self._lock:
+            if self._flights.get(name) is flight:
+                del self._flights[name]
+        flight.resolve(value, exc_info)
+
+    @staticmethod
+    def cached_property(func=None, ttl=None, persistent=False):
+        """Decorator for properties which values are cached in the object.
 
-        return _wrapper_
+        Can be used either as `@cached_property` or `@cached_property(ttl=<seconds>, persistent=True)`.
+            Cached values of all properties can be nullified with `clear_cache()`.
+        """
+        if func is None:
+            return functools.partial(CachedProperty, ttl=ttl, persistent=persistent)
+        return CachedProperty(func, ttl=ttl, persistent=persistent)
 
 
 class StackResource(Base):
     """Generic stack resource with generic __init__ args"""
 
+    #   _batch_failed_at: monotonic time AWS rejected the resource id in a batched describe, None if it didn't
+    __slots__ = ('name', 'stack', '_batch_failed_at')
+
     boto_service_name = 'name of the boto3 service for used to access this resource'
 
     def __init__(self, stack, name):
@@ -80,10 +341,236 @@ class StackResource(Base):
         super(StackResource, self).__init__()
         self.name = name
         self.stack = stack
+        self._batch_failed_at = None
 
     cached_property = Base.cached_property
 
+    def get_cache_ttl(self, name, default):
+        return self.stack.get_cache_ttl(name, default)
+
+    def clear_cache(self):
+        super(StackResource, self).clear_cache()
+        self._batch_failed_at = None
+
+    # Cached properties that aren't derived from `describe`, all others expire along with it
+    _describe_independent_properties = frozenset(['describe', 'conn'])
+
+    def _expiry(self, name):
+        expires = super(StackResource, self)._expiry(name)
+        if name in self._describe_independent_properties:
+            return expires
+        # Values derived from `describe` must not outlive it
+        with self._lock:
+            entry = (self._cache or {}).get('describe')
+        describe_expires = self._expiry('describe') if entry is None else entry[1]
+        if describe_expires is None or (expires is not None and expires < describe_expires):
+            return expires
+        return describe_expires
+
+    @property
+    def persistent_cache(self):
+        return self.stack.persistent_cache
+
+    def _loaded_from_persistent(self, max_age):
+        self.stack._loaded_from_persistent(max_age)
+
+    def persistent_cache_key(self, name):
+        return self.stack.persistent_cache_key('{}:{}:{}'.format(self.resource_type, self.name, name))
+
     @cached_property
     def conn(self):
         """Boto3 connection object"""
         return self.stack.boto_client(self.boto_service_name)
+
+    # Max number of resource names `describe_many()` accepts in one call.
+    #   `None` means that the resource type doesn't support batched describe calls.
+    describe_batch_size = None
+    # Seconds a resource which id AWS rejected in a batched describe is left out of the later batches
+    batch_failure_ttl = 300
+
+    @property
+    def batch_excluded(self):
+        """True if the resource is left out of batched describes, see `batch_failure_ttl`"""
+        failed_at = self._batch_failed_at
+        return failed_at is not None and monotonic() - failed_at < self.batch_failure_ttl
+
+    @classmethod
+    def describe_many(cls, conn, names):
+        """Describe multiple resources of this type with a single AWS call.
+
+        Returns {<name>: <describe data>} dict. Resources not found by AWS are omitted.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def describe_batch(cls, resources):
+        """Describe all `resources` with as few AWS calls as possible.
+
+        Returns {<name>: <describe data>} dict. Resources which ids AWS rejects are omitted (and left out of
+            the later batches), other errors (e.g. throttling) are raised.
+        """
+        resources = tuple(resources)
+        if not resources:
+            return {}
+        conn = resources[0].conn
+        out = {}
+        for chunk in iter_chunks(resources, cls.describe_batch_size):
+            cls._describe_chunk(conn, chunk, out)
+        return out
+
+    @classmethod
+    def _describe_chunk(cls, conn, chunk, out):
+        try:
+            out.update(cls.describe_many(conn, [el.name for el in chunk]))
+            return
+        except botocore.exceptions.ClientError as err:
+            code = err.response.get('Error', {}).get('Code', '')
+            if not code.endswith(_NOT_FOUND_ERRORS):
+                raise
+        log.info('Batched describe of {} {} resources failed: {}'.format(len(chunk), cls.resource_type, code))
+        if len(chunk) > 1:
+            # AWS rejects whole batch if any of the resources doesn't exist, bisect it to find them
+            half = len(chunk) // 2
+            cls._describe_chunk(conn, chunk[:half], out)
+            cls._describe_chunk(conn, chunk[half:], out)
+            return
+        # Leave the unknown resource out of the later batches, so its describe calls AWS for it alone
+        chunk[0]._batch_failed_at = monotonic()
+
+    @classmethod
+    def load_many(cls, resources):
+        """Prime `describe` caches of all `resources` using as few AWS calls as possible, see `describe_batch()`"""
+        pending = [el for el in resources if not el.is_cached('describe') and not el.batch_excluded]
+        if cls.describe_batch_size is None:
+            # No batch API - describe resources one by one
+            for el in pending:
+                el.describe
+        else:
+            pending = cls._without_persisted(pending)
+            describes = cls.describe_batch(pending)
+            for el in pending:
+                if el.name in describes:
+                    el.prime_cache('describe', describes[el.name])
+
+    def load_alone(self):
+        """Prime `describe` cache of this resource (unless it is cached) with a describe call of its own"""
+        if not self.is_cached('describe'):
+            self.prime_cache('describe', self.describe_many(self.conn, [self.name])[self.name])
+
+    @classmethod
+    def _without_persisted(cls, resources):
+        """Cache `describe` data of the `resources` found in the persistent cache, return list of the rest"""
+        if not getattr(getattr(cls, 'describe', None), 'persistent', False):
+            return list(resources)
+        out = []
+        for el in resources:
+            try:
+                el._store_cached('describe', el._load_persistent('describe'))
+            except KeyError:
+                out.append(el)
+        return out
+
+    # {<object attribute name>: <AWS filter name>} of the criteria `describe_filtered()` can evaluate on AWS side.
+    #   Empty dict means that the resource type doesn't support AWS-side filtering.
+    query_filters = {}
+    # Template of AWS filter name for the tag filters (e.g. 'tag:{}'), None if tag filters aren't supported.
+    tag_query_filter = None
+
+    @classmethod
+    def describe_filtered(cls, conn, filters):
+        """Describe all resources of this type matching AWS `filters` list.
+
+        Returns {<name>: <describe data>} dict.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def query_filter_value(cls, value):
+        """Convert query value to the AWS filter value"""
+        if isinstance(value, Enum):
+            value = value.name
+        if not isinstance(value, six.string_types):
+            value = str(value)
+        return value
+
+    def adescribe(self):
+        """Return asyncio future of `describe`"""
+        return self.aget('describe')
+
+    @property
+    def write_through_tags(self):
+        return self.stack.write_through_tags
+
+    # Max number of resources `write_tags_many()` updates with one AWS call.
+    #   `None` means that the resource type doesn't support batched tag writes.
+    tag_batch_size = None
+
+    @classmethod
+    def write_tags_many(cls, conn, writes):
+        """Write tags of multiple resources of this type with as few AWS calls as possible.
+
+        `writes` is a list of (<resource name>, <list of tags to set>, <list of tags to delete>)
+        """
+        raise NotImplementedError
+
+    # Max number of resources `stop_many()`/`start_many()` act on with one AWS call.
+    #   `None` means that the resources of this type are stopped and started one by one.
+    lifecycle_batch_size = None
+    # Cached properties that are out of date once the resource was stopped or started
+    lifecycle_cached_properties = ('describe', )
+
+    @classmethod
+    def stop_many(cls, conn, names):
+        """Stop the resources `names` of this type with one AWS call"""
+        raise NotImplementedError
+
+    @classmethod
+    def start_many(cls, conn, names):
+        """Start the resources `names` of this type with one AWS call"""
+        raise NotImplementedError
+
+    def _tag_committer(self):
+        """Return function the tag commits of this resource are deferred to (None if they are written immediately)"""
+        writer = self.stack.active_tag_writer
+        if writer is None:
+            return None
+        return functools.partial(writer.defer, self)
+
+    def _update_described_tags(self, tags, key='Tags'):
+        """Replace tags in the cached `describe` data (if any) with the committed `tags` list.
+
+        The patched data expires along with the described one. Its persisted copy is deleted rather than
+            re-saved, so the data doesn't pass for a fresh describe.
+        """
+        with self._lock:
+            try:
+                describe = self._get_cached_locked('describe')
+            except KeyError:
+                return
+            describe = dict(describe)
+            describe[key] = tags
+            self._cache['describe'] = (describe, self._cache['describe'][1])
+        if getattr(getattr(self.__class__, 'describe', None), 'persistent', False):
+            self._delete_persistent('describe')
+
+    def describe_with_siblings(self):
+        """Describe this resource along with all not yet described resources of the same type in the stack.
+
+        Caches of the sibling resources are primed with their `describe` data,
+            the `describe` data of this object is returned.
+        """
+        if self.batch_excluded:
+            return self.describe_many(self.conn, [self.name])[self.name]
+        siblings = self._without_persisted(
+            el for el in self.stack.sibling_resources(self)
+            if el is not self and not el.is_cached('describe') and not el.batch_excluded
+        )
+        describes = self.describe_batch([self] + siblings)
+        for el in siblings:
+            if el.name in describes:
+                el.prime_cache('describe', describes[el.name])
+
+        try:
+            return describes[self.name]
+        except KeyError:
+            return self.describe_many(self.conn, [self.name])[self.name]
@@ -1,14 +1,34 @@
 """AWS::CloudFormation::*"""
+import calendar
+import collections
+import contextlib
+import functools
+import logging
 import re
-import boto3
+import threading
+import time
 import uuid
+import concurrent.futures
+import six
 from frozendict import frozendict
 
-from . import base
+from . import base, query, unit_of_work as cf_unit_of_work, waiter as cf_waiter
+from .. import (
+    aio,
+    client_pool as cf_client_pool,
+    identity_map as cf_identity_map,
+)
+
+
+log = logging.getLogger(__name__)
+
+ResourceIndex = collections.namedtuple('ResourceIndex', ['resources', 'by_physical_id', 'by_type'])
 
 
 class StackResource(base.Base):
 
+    __slots__ = ('stack', 'data')
+
     def __init__(self, stack, aws_data):
         super(StackResource, self).__init__()
         self.stack = stack
@@ -30,6 +50,9 @@ class StackResource(base.Base):
     def physical_id(self):
         return self.data['PhysicalResourceId']
 
+    def get_cache_ttl(self, name, default):
+        return self.stack.get_cache_ttl(name, default)
+
     @base.Base.cached_property
     def resource(self):
         """Actual AWS resource handle for this object.
@@ -37,7 +60,7 @@ class StackResource(base.Base):
         Raises KeyError if resource type isn't supported yet.
         """
         cls = self.stack.registry[self.type]
-        return cls(self.stack, self.physical_id)
+        return self.stack.resource_object(cls, self.physical_id)
 
     def __repr__(self):
         return "<{} data={}>".format(self.__class__.__name__, self.data)
@@ -47,23 +70,178 @@ class Stack(base.Base):
 
     resource_type = 'AWS::CloudFormation::Stack'
 
-    def __init__(self, name, registry, boto_kwargs):
+    def __init__(self, name, registry, boto_kwargs, client_pool=None, parent=None, cache_ttl=None,
+                 persistent_cache=None, identity_map=None, write_through_tags=False, write_behind=None, poller=None):
+        """
+        :param name: stack name or id
+        :param registry: resource registry object
+        :param boto_kwargs: extra arguments passed to boto3.client() calls
+        :param client_pool: `ClientPool` object to take boto3 clients from (a private pool is created if None)
+        :param parent: parent `Stack` object if this is a nested stack
+        :param cache_ttl: {<cached property name>: <ttl seconds>} dict overriding cache TTLs of
+            the stack and all its resources
+        :param persistent_cache: persistent cache backend (e.g. `cfalchemy.persistent_cache.SqliteCache`)
+            for the describe data of the stack and its resources
+        :param identity_map: `IdentityMap` that holds resource objects of the stack (a new one is created if None)
+        :param write_through_tags: apply tag writes to the cached tags and `describe` data of the resources
+            instead of purging their caches
+        :param write_behind: `WriteBehindQueue` the tag writes of the stack resources are deferred to
+        :param poller: `Poller` that polls the resources awaited by `wait_until()` (a new one is created if None)
+        """
         super(Stack, self).__init__()
         self._input_name = name
+        self.parent = parent
+        self.cache_ttl = dict(cache_ttl or {})
+        self.persistent_cache = persistent_cache
         self.registry = registry
         self._boto_kwargs = dict(boto_kwargs)
+        if client_pool is None:
+            client_pool = cf_client_pool.ClientPool()
+        self.client_pool = client_pool
+        if identity_map is None:
+            identity_map = cf_identity_map.IdentityMap()
+        self.identity_map = identity_map
+        self.write_through_tags = write_through_tags
+        self.write_behind = write_behind
+        if poller is None:
+            poller = cf_waiter.Poller()
+        self.poller = poller
+        self._units_of_work = threading.local()
         self.conn = self.boto_client('cloudformation')
 
+    def resource_object(self, cls, name):
+        """Return object of the resource class `cls` for the AWS resource `name`.
+
+        Objects are shared via the identity map, so there is at most one object (and one cache) per AWS resource.
+        """
+        if issubclass(cls, Stack):
+            factory = functools.partial(self._mk_nested_stack, name)
+        else:
+            factory = functools.partial(cls, self, name)
+        return self.identity_map.get_or_create(cls, name, factory)
+
+    def clear_cache(self):
+        """Delete all cached data of the stack and of the resource objects (incl. nested stacks) it has created"""
+        super(Stack, self).clear_cache()
+        for obj in self._mapped_objects():
+            obj.clear_cache()
+
+    def _mapped_objects(self):
+        """Return objects of the identity map that were created by this stack"""
+        return [
+            obj for obj in self.identity_map.objects()
+            if obj is not self and (getattr(obj, 'stack', None) is self or getattr(obj, 'parent', None) is self)
+        ]
+
+    def nested_stack(self, name):
+        """Return `Stack` object for the nested stack `name` that shares boto3 clients and caches with this stack"""
+        return self.resource_object(self.__class__, name)
+
+    def _mk_nested_stack(self, name):
+        return self.__class__(
+            name, self.registry, self._boto_kwargs,
+            client_pool=self.client_pool, parent=self, cache_ttl=self.cache_ttl,
+            persistent_cache=self.persistent_cache, identity_map=self.identity_map,
+            write_through_tags=self.write_through_tags, write_behind=self.write_behind, poller=self.poller,
+        )
+
+    @contextlib.contextmanager
+    def unit_of_work(self):
+        """Defer tag writes of the stack resources made by the current thread until the end of the context.
+
+        The writes are then made with as few AWS calls as possible (e.g. one `create_tags` call for all
+            EC2 instances that get identical tags). Pending writes are dropped if the context exits with an exception.
+        """
+        uow = cf_unit_of_work.UnitOfWork()
+        self._my_units_of_work.append(uow)
+        try:
+            yield uow
+        except:  # noqa
+            self._my_units_of_work.pop()
+            uow.discard()
+            raise
+        else:
+            self._my_units_of_work.pop()
+            uow.flush()
+
+    @property
+    def _my_units_of_work(self):
+        try:
+            return self._units_of_work.stack
+        except AttributeError:
+            self._units_of_work.stack = []
+        return self._units_of_work.stack
+
+    @property
+    def active_tag_writer(self):
+        """Return unit of work the tag writes of the current thread are deferred to (None if there is none)"""
+        if self._my_units_of_work:
+            return self._my_units_of_work[-1]
+        if self.write_behind is not None:
+            return self.write_behind
+        if self.parent is not None:
+            return self.parent.active_tag_writer
+        return None
+
+    def get_cache_ttl(self, name, default):
+        return self.cache_ttl.get(name, default)
+
+    def persistent_cache_key(self, name):
+        if name == 'aws_describe':
+            # Stack id isn't known before the stack is described and the stack name is unique only within
+            #   an account and region, so the key is bound to the resolved region and account of the credentials
+            return 'stack:{}:{}:{}:{}'.format(
+                self.conn.meta.region_name,
+                self._caller_account_id,
+                self._input_name,
+                name,
+            )
+        # All other data is bound to particular version of the stack
+        describe = self.aws_describe
+        version = describe.get('LastUpdatedTime', describe.get('CreationTime'))
+        return '{}@{}:{}'.format(self.stack_id, version, name)
+
+    @property
+    def nested_stacks(self):
+        """Tuple of `Stack` objects nested in this stack (non-recursive)"""
+        return tuple(
+            res.resource
+            for res in self.resources_by_type(self.resource_type)
+        )
+
+    def walk(self, max_workers=8):
+        """Iterate over this stack and all stacks nested in it (recursively).
+
+        Nested stacks are discovered concurrently by a pool of `max_workers` threads,
+            so the time it takes to walk the tree depends on its depth rather than on the number of stacks.
+        """
+        yield self
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set([executor.submit(_get_nested_stacks, self)])
+            while pending:
+                (done, pending) = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    for child in future.result():
+                        yield child
+                        pending.add(executor.submit(_get_nested_stacks, child))
+
     def boto_client(self, module):
-        return boto3.client(module, **self._boto_kwargs)
+        """Return (pooled) boto3 client for the AWS service"""
+        return self.client_pool.get(module, **self._boto_kwargs)
 
-    @base.Base.cached_property
+    @base.Base.cached_property(persistent=True)
     def aws_describe(self):
+        self._note_loaded(time.time())
         return self.conn.describe_stacks(StackName=self._input_name)['Stacks'][0]
 
-    @base.Base.cached_property
+    def adescribe(self):
+        """Return asyncio future of `aws_describe`"""
+        return self.aget('aws_describe')
+
+    @property
     def aws_resources(self):
-        return self.conn.describe_stack_resources(StackName=self.name)['StackResources']
+        """List of resource summaries as returned by the `list_stack_resources` call"""
+        return [res.data for res in self.resources.values()]
 
     @property
     def stack_id(self):
@@ -80,6 +258,15 @@ class Stack(base.Base):
     def cfalchemy_uuid(self):
         return self.aws_describe['StackId']
 
+    @base.Base.cached_property
+    def _caller_account_id(self):
+        """Id of the AWS account the stack is accessed with, known without describing the stack"""
+        if self._input_name.startswith('arn:'):
+            return self._input_name.split(':')[4]
+        if self.parent is not None:
+            return self.parent._caller_account_id
+        return self.boto_client('sts').get_caller_identity()['Account']
+
     @property
     def region(self):
         return self._parsed_stack_id[0]
@@ -127,22 +314,406 @@ class Stack(base.Base):
 
     @base.Base.cached_property
     def resources(self):
-        resources = [
-            StackResource(self, data)
-            for data in self.aws_resources
-        ]
         # logical_ids must be unique in scope of particular stack instance
         return frozendict(
             (res.logical_id, res)
-            for res in resources
+            for res in self._list_resources()
+        )
+
+    def aresources(self):
+        """Return asyncio future of `resources`"""
+        return self.aget('resources')
+
+    def iter_resources(self):
+        """Iterate over `StackResource` objects of this stack.
+
+        Resources are yielded as soon as each page of the `list_stack_resources` response arrives,
+            the `resources` cache is populated once the last page is received.
+        """
+        if self.is_cached('resources'):
+            return iter(self.resources.values())
+        return self._list_and_cache_resources()
+
+    def _list_and_cache_resources(self):
+        out = []
+        for res in self._list_resources():
+            out.append(res)
+            yield res
+        self.prime_cache('resources', frozendict((res.logical_id, res) for res in out))
+
+    def _list_resources(self, use_persistent_cache=True):
+        for data in self._list_resource_summaries(use_persistent_cache):
+            yield StackResource(self, data)
+
+    def _list_resource_summaries(self, use_persistent_cache=True):
+        try:
+            if not use_persistent_cache:
+                raise KeyError('aws_resources')
+            summaries = self._load_persistent('aws_resources')
+        except KeyError:
+            pass
+        else:
+            for data in summaries:
+                yield data
+            return
+
+        summaries = []
+        self._note_loaded(time.time())
+        paginator = self.conn.get_paginator('list_stack_resources')
+        for page in paginator.paginate(StackName=self.name):
+            for data in page['StackResourceSummaries']:
+                summaries.append(data)
+                yield data
+        self._save_persistent('aws_resources', summaries)
+
+    _last_event_id = None
+    # Wall clock time the oldest cached data of the stack or of its resources was loaded from AWS at,
+    #   None if nothing was loaded yet and 0 if it isn't known. The first `refresh()` looks for changes since then.
+    _loaded_at = None
+
+    def _note_loaded(self, loaded_at):
+        with self._lock:
+            if self._loaded_at is None or loaded_at < self._loaded_at:
+                self._loaded_at = loaded_at
+
+    def _loaded_from_persistent(self, max_age):
+        max_ages = [el for el in (max_age, getattr(self.persistent_cache, 'max_age', None)) if el is not None]
+        self._note_loaded(time.time() - min(max_ages) if max_ages else 0)
+
+    def arefresh(self):
+        """Return asyncio future of `refresh()`"""
+        return aio.run_in_executor(self.refresh)
+
+    def refresh(self):
+        """Invalidate cached data of the stack and its resources that changed since the previous `refresh()` call.
+
+        Changes are detected from the stack events, so refreshing an unchanged stack costs one
+            `describe_stack_events` call and cached data of the unchanged resources is kept.
+            The first call looks for the events newer than the cached data (everything is invalidated if the age
+            of the data loaded from the persistent cache isn't limited).
+
+        Returns frozenset of the logical ids of changed resources (the stack itself is identified by its name).
+        """
+        (changed, all_seen) = self._poll_stack_events()
+        if not all_seen:
+            # The previously seen event is gone - impossible to tell what has changed,
+            #   so drop cached data of the stack and of all resource objects it has created (see `clear_cache()`)
+            self.clear_cache()
+            return changed
+
+        if self.name in changed:
+            self.invalidate('aws_describe', 'outputs', 'parameters', 'tags')
+        if changed and self.is_cached('resources'):
+            self._refresh_resources(changed)
+        return changed
+
+    def _poll_stack_events(self):
+        """Return (<logical ids of the new events>, <True if all events since the last poll were seen>)"""
+        last_event_id = self._last_event_id
+        changed = set()
+        newest_event_id = None
+        all_seen = False
+        pages = self.conn.get_paginator('describe_stack_events').paginate(StackName=self.name)
+        # Read after the stack name (and so `aws_describe`) is loaded
+        since = self._loaded_at
+        # Events are returned in reverse chronological order
+        for page in pages:
+            for event in page['StackEvents']:
+                if newest_event_id is None:
+                    newest_event_id = event['EventId']
+                if last_event_id is not None:
+                    seen = event['EventId'] == last_event_id
+                else:
+                    # First poll - the events older than the cached data are seen already
+                    seen = not since or _event_time(event) < since
+                if seen:
+                    all_seen = True
+                    break
+                changed.add(event['LogicalResourceId'])
+            if all_seen:
+                break
+
+        if newest_event_id is not None:
+            self._last_event_id = newest_event_id
+        if last_event_id is None:
+            # All events newer than the cached data were seen, unless its age isn't known
+            all_seen = since != 0
+        return (frozenset(changed), all_seen)
+
+    def _refresh_resources(self, changed_logical_ids):
+        old_resources = self.resources
+        for logical_id in changed_logical_ids:
+            res = old_resources.get(logical_id)
+            if res is not None and res.is_cached('resource'):
+                res.resource.clear_cache()
+
+        # Re-list resources (their physical ids might have changed), but keep objects of the unchanged ones
+        new_resources = []
+        for res in self._list_resources(use_persistent_cache=False):
+            if res.logical_id in old_resources and res.logical_id not in changed_logical_ids:
+                res = old_resources[res.logical_id]
+            new_resources.append(res)
+        self.prime_cache('resources', frozendict((res.logical_id, res) for res in new_resources))
+
+    def load(self, types=None, with_tags=False):
+        """Eagerly load the stack and its resources.
+
+        :param types: iterable of resource types (e.g. 'AWS::EC2::Instance') to load;
+            all resource types supported by the registry are loaded if None.
+        :param with_tags: load tags of the resources as well
+
+        Resources of the same type are loaded with batched AWS calls where the AWS API permits.
+        Returns the stack object.
+        """
+        self.aws_describe
+        if types is not None:
+            types = frozenset(types)
+        for (resource_type, stack_resources) in self._current_resource_index.by_type.items():
+            if resource_type not in self.registry or (types is not None and resource_type not in types):
+                continue
+            cls = self.registry[resource_type]
+            if issubclass(cls, Stack):
+                # Nested stacks are discovered by `walk()`
+                continue
+            objects = [res.resource for res in stack_resources]
+            cls.load_many(objects)
+            if with_tags and hasattr(cls, 'tags'):
+                for obj in objects:
+                    obj.tags.prefetch()
+        return self
+
+    def aload(self, types=None, with_tags=False):
+        """Return asyncio future of `load()`"""
+        return aio.run_in_executor(self.load, types=types, with_tags=with_tags)
+
+    def ahydrate(self, max_workers=8, types=None, with_tags=True):
+        """Return asyncio future of `hydrate()`"""
+        return aio.run_in_executor(self.hydrate, max_workers=max_workers, types=types, with_tags=with_tags)
+
+    def hydrate(self, max_workers=8, types=None, with_tags=True):
+        """Load `describe` (and `tags`) of the stack resources concurrently by a pool of `max_workers` threads.
+
+        :param types: iterable of resource types to load; all resource types supported by the registry if None.
+
+        Resource types with batch describe API are described in batches first, the remaining loads are
+            submitted to the pool grouped by AWS service, so the workers share the pooled clients.
+            Resources of a type which batch failed are described one by one.
+        Returns {<logical id>: <exception>} dict of the resources that failed to load.
+        """
+        self.aws_describe
+        if types is not None:
+            types = frozenset(types)
+        # {<boto service name>: [(<logical id>, <resource object>), ...]}
+        by_service = collections.OrderedDict()
+        batched = []
+        for (resource_type, stack_resources) in sorted(self._current_resource_index.by_type.items()):
+            if resource_type not in self.registry or (types is not None and resource_type not in types):
+                continue
+            cls = self.registry[resource_type]
+            if issubclass(cls, Stack):
+                continue
+            if cls.describe_batch_size is not None:
+                batched.append((cls, [res.resource for res in stack_resources]))
+            service_objects = by_service.setdefault(cls.boto_service_name, [])
+            service_objects.extend((res.logical_id, res.resource) for res in stack_resources)
+
+        for service in by_service:
+            # Create the clients up front, so the workers don't race for them
+            self.boto_client(service)
+
+        errors = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            batch_futures = dict((executor.submit(cls.load_many, objects), cls) for (cls, objects) in batched)
+            # Resource classes which batches failed, so their resources are described one by one below
+            failed = set()
+            for future in concurrent.futures.as_completed(batch_futures):
+                exc = future.exception()
+                if exc is not None:
+                    cls = batch_futures[future]
+                    log.warning('Batched describe of {} resources failed: {!r}'.format(cls.resource_type, exc))
+                    failed.add(cls)
+            futures = dict(
+                (executor.submit(_hydrate_resource, obj, with_tags, obj.__class__ in failed), logical_id)
+                for service_objects in by_service.values()
+                for (logical_id, obj) in service_objects
+            )
+            for future in concurrent.futures.as_completed(futures):
+                exc = future.exception()
+                if exc is not None:
+                    errors[futures[future]] = exc
+        return errors
+
+    def stop(self, resources, max_workers=8):
+        """Stop `resources` (resource objects or their logical/physical ids), see `start()`"""
+        return self._change_lifecycle('stop', resources, max_workers)
+
+    def start(self, resources, max_workers=8):
+        """Start `resources` (resource objects or their logical/physical ids).
+
+        Resource types with batch API (see `StackResource.lifecycle_batch_size`) are started with chunked
+            `start_many()` calls, the rest one by one. The calls are made concurrently by a pool of `max_workers`
+            threads, only the state-related caches of the started resources are invalidated.
+        Returns {<resource name>: <exception>} dict of the resources that failed to start.
+        """
+        return self._change_lifecycle('start', resources, max_workers)
+
+    def _change_lifecycle(self, action, resources, max_workers):
+        # {(<resource class>, <boto client>): [<resource object>, ...]}
+        groups = collections.OrderedDict()
+        for obj in self._resource_objects(resources):
+            if not callable(getattr(obj, action, None)):
+                raise TypeError('{!r} does not support {}()'.format(obj, action))
+            groups.setdefault((obj.__class__, obj.conn), []).append(obj)
+
+        # [(<callable>, <resource objects it acts on>), ...]
+        tasks = []
+        for ((cls, conn), objects) in groups.items():
+            if cls.lifecycle_batch_size is None:
+                tasks.extend((getattr(obj, action), (obj, )) for obj in objects)
+                continue
+            for chunk in base.iter_chunks(objects, cls.lifecycle_batch_size):
+                tasks.append((functools.partial(_change_lifecycle_many, cls, action, conn, chunk), chunk))
+
+        errors = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = dict((executor.submit(func), objects) for (func, objects) in tasks)
+            for future in concurrent.futures.as_completed(futures):
+                exc = future.exception()
+                if exc is not None:
+                    errors.update((obj.name, exc) for obj in futures[future])
+        return errors
+
+    def watch(self, resources, state, timeout=None):
+        """Return {<resource name>: <future>} of `resources` (resource objects or their logical/physical ids).
+
+        Each `concurrent.futures.Future` is resolved with the resource object once it reaches the `state`
+            or fails with `cfalchemy.stack.waiter.WaitTimeout` after `timeout` seconds, see `wait_until()`.
+        """
+        return collections.OrderedDict(
+            (obj.name, self.poller.watch(obj, state, timeout))
+            for obj in self._resource_objects(resources)
+        )
+
+    def wait_until(self, resources, state, timeout=None):
+        """Wait until all `resources` (resource objects or their logical/physical ids) reach the `state`.
+
+        `state` is a name of boolean attribute of the resources (e.g. 'running', 'stopped', 'converged'),
+            a state enum member (e.g. `InstanceState.running`) or a predicate accepting the resource object.
+        The resources are polled by the shared `poller`, which describes all watched resources of a type
+            with one batched call per tick.
+        Returns {<resource name>: <exception>} dict of the resources that didn't reach the state in `timeout` seconds.
+        """
+        futures = self.watch(resources, state, timeout)
+        errors = {}
+        for (name, future) in futures.items():
+            exc = future.exception()
+            if exc is not None:
+                errors[name] = exc
+        return errors
+
+    def await_until(self, resources, state, timeout=None):
+        """Return asyncio future of `wait_until()`"""
+        return aio.run_in_executor(self.wait_until, resources, state, timeout)
+
+    def _resource_objects(self, resources):
+        out = []
+        for obj in resources:
+            if isinstance(obj, six.string_types):
+                obj = self.get_resource(obj).resource
+            if not isinstance(obj, base.StackResource):
+                raise TypeError('{!r} is not a stack resource'.format(obj))
+            out.append(obj)
+        return out
+
+    @base.Base.cached_property
+    def _resource_index(self):
+        resources = self.resources
+        by_physical_id = {}
+        by_type = {}
+        for res in resources.values():
+            # First resource wins if physical ids clash
+            by_physical_id.setdefault(res.physical_id, res)
+            by_type.setdefault(res.type, []).append(res)
+        return ResourceIndex(
+            resources,
+            frozendict(by_physical_id),
+            frozendict(
+                (resource_type, tuple(type_resources))
+                for (resource_type, type_resources) in by_type.items()
+            ),
+        )
+
+    @property
+    def _current_resource_index(self):
+        index = self._resource_index
+        if index.resources is not self.resources:
+            # `resources` were re-loaded since the index was built
+            self.invalidate('_resource_index')
+            index = self._resource_index
+        return index
+
+    def resources_by_type(self, resource_type):
+        """Return tuple of all `StackResource` objects of the `resource_type` (e.g. 'AWS::EC2::Instance')"""
+        return self._current_resource_index.by_type.get(resource_type, ())
+
+    def query(self, resource_cls):
+        """Return `Query` for resources of this stack of given class (or resource type name)"""
+        if isinstance(resource_cls, six.string_types):
+            resource_cls = self.registry[resource_cls]
+        return query.Query(self, resource_cls)
+
+    def sibling_resources(self, resource):
+        """Return all resource objects of this stack that have the same type as `resource`.
+
+        Includes the objects this stack created for the resources defined outside of it
+            (e.g. subnets of a shared VPC), so they are described in the same batches.
+        """
+        out = [res.resource for res in self.resources_by_type(resource.resource_type)]
+        seen = set(id(el) for el in out)
+        out.extend(
+            el for el in self.identity_map.objects(resource.__class__)
+            if getattr(el, 'stack', None) is self and id(el) not in seen
         )
+        return tuple(out)
 
     def get_resource(self, logical_or_physical_id, default=KeyError):
-        for resource in self.resources.values():
-            if logical_or_physical_id in (resource.physical_id, resource.logical_id):
-                return resource
+        try:
+            return self.resources[logical_or_physical_id]
+        except KeyError:
+            pass
+        try:
+            return self._current_resource_index.by_physical_id[logical_or_physical_id]
+        except KeyError:
+            pass
         # not found
         if default is KeyError:
             raise KeyError(logical_or_physical_id)
         else:
             return default
+
+
+def _get_nested_stacks(stack):
+    return stack.nested_stacks
+
+
+def _change_lifecycle_many(cls, action, conn, objects):
+    try:
+        getattr(cls, action + '_many')(conn, [el.name for el in objects])
+    finally:
+        for el in objects:
+            el.invalidate(*el.lifecycle_cached_properties)
+
+
+def _event_time(event):
+    """Return wall clock time of the stack `event`"""
+    timestamp = event['Timestamp']
+    return calendar.timegm(timestamp.utctimetuple()) + timestamp.microsecond / 1e6
+
+
+def _hydrate_resource(obj, with_tags, alone=False):
+    if alone:
+        obj.load_alone()
+    else:
+        obj.describe
+    if with_tags and hasattr(obj, 'tags'):
+        obj.tags.prefetch()
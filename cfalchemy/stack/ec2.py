@@ -1,3 +1,4 @@
+import collections
 from enum import Enum
 
 from . import base
@@ -17,19 +18,72 @@ class InstanceState(Enum):
 
 class ECInstance(base.StackResource):
 
+    __slots__ = ()
+
     resource_type = 'AWS::EC2::Instance'
     boto_service_name = 'ec2'
 
+    describe_batch_size = 1000
+    query_filters = {
+        'instance_id': 'instance-id',
+        'state': 'instance-state-name',
+        'dns_name': 'private-dns-name',
+        'private_ip': 'private-ip-address',
+        'public_ip': 'ip-address',
+    }
+    tag_query_filter = 'tag:{}'
+    tag_batch_size = 1000
+    lifecycle_batch_size = 1000
+
     @property
     def instance_id(self):
         return self.name
 
-    @base.StackResource.cached_property
+    @classmethod
+    def describe_many(cls, conn, names):
+        return cls._index_reservations(conn.describe_instances(InstanceIds=list(names))['Reservations'])
+
+    @classmethod
+    def describe_filtered(cls, conn, filters):
+        out = {}
+        for page in conn.get_paginator('describe_instances').paginate(Filters=filters):
+            out.update(cls._index_reservations(page['Reservations']))
+        return out
+
+    @classmethod
+    def query_filter_value(cls, value):
+        if isinstance(value, InstanceState):
+            # AWS uses 'shutting-down' for InstanceState.shutting_down
+            return value.name.replace('_', '-')
+        return super(ECInstance, cls).query_filter_value(value)
+
+    @classmethod
+    def write_tags_many(cls, conn, writes):
+        # Instances getting identical tag changes are updated with one call
+        creates = collections.OrderedDict()
+        deletes = collections.OrderedDict()
+        for (name, to_set, to_delete) in writes:
+            for (groups, tags) in ((creates, to_set), (deletes, to_delete)):
+                if tags:
+                    tags = sorted(tags, key=lambda el: el['Key'])
+                    key = tuple(tuple(sorted(el.items())) for el in tags)
+                    groups.setdefault(key, (tags, []))[1].append(name)
+        for (groups, method) in ((creates, conn.create_tags), (deletes, conn.delete_tags)):
+            for (tags, names) in groups.values():
+                for chunk in base.iter_chunks(names, cls.tag_batch_size):
+                    method(Resources=list(chunk), Tags=tags)
+
+    @staticmethod
+    def _index_reservations(reservations):
+        out = {}
+        for reservation in reservations:
+            for instance in reservation['Instances']:
+                out[instance['InstanceId']] = instance
+        return out
+
+    @base.StackResource.cached_property(persistent=True)
     def describe(self):
-        res = self.conn.describe_instances(InstanceIds=[self.instance_id])['Reservations']
-        assert len(res) == 1
-        assert len(res[0]['Instances']) == 1
-        return res[0]['Instances'][0]
+        return self.describe_with_siblings()
 
     @base.StackResource.cached_property
     def cfalchemy_uuid(self):
@@ -40,9 +94,22 @@ class ECInstance(base.StackResource):
     def dns_name(self):
         return self.describe['PrivateDnsName']
 
+    @classmethod
+    def load_subnets(cls, instances):
+        """Return {<instance id>: <Subnet>} of the `instances`, the subnets are described with one batched call"""
+        cls.load_many(instances)
+        out = collections.OrderedDict((el.name, el.subnet) for el in instances)
+        Subnet.load_many(list(collections.OrderedDict((id(el), el) for el in out.values()).values()))
+        return out
+
     @base.StackResource.cached_property
     def subnet(self):
-        return self.stack.get_resource(self.describe['SubnetId']).resource
+        subnet_id = self.describe['SubnetId']
+        res = self.stack.get_resource(subnet_id, default=None)
+        if res is not None:
+            return res.resource
+        # Subnet defined outside of the stack (e.g. in a shared VPC)
+        return self.stack.resource_object(Subnet, subnet_id)
 
     @property
     def public_ip(self):
@@ -70,20 +137,31 @@ class ECInstance(base.StackResource):
                 Tags=list(els)
             ),
             on_cache_purged=lambda: self.clear_cache(),
+            write_through=self.write_through_tags,
+            on_committed=self._update_described_tags,
+            committer=self._tag_committer,
         )
 
+    @classmethod
+    def stop_many(cls, conn, names):
+        conn.stop_instances(InstanceIds=list(names))
+
+    @classmethod
+    def start_many(cls, conn, names):
+        conn.start_instances(InstanceIds=list(names))
+
     def stop(self):
         """Stop the instance"""
         try:
-            self.conn.stop_instances(InstanceIds=[self.instance_id])
+            self.stop_many(self.conn, [self.instance_id])
         finally:
-            self.clear_cache()
+            self.invalidate(*self.lifecycle_cached_properties)
 
     def start(self):
         try:
-            self.conn.start_instances(InstanceIds=[self.instance_id])
+            self.start_many(self.conn, [self.instance_id])
         finally:
-            self.clear_cache()
+            self.invalidate(*self.lifecycle_cached_properties)
 
     # Instance states
 
@@ -101,9 +179,13 @@ class ECInstance(base.StackResource):
 
 class Subnet(base.StackResource):
 
+    __slots__ = ()
+
     resource_type = 'AWS::EC2::Subnet'
     boto_service_name = 'ec2'
 
+    describe_batch_size = 1000
+
     @property
     def subnet_id(self):
         return self.name
@@ -113,9 +195,13 @@ class Subnet(base.StackResource):
         # EC2 instances don't have ARNs
         return "cfalchemy::ec2::subnet::{}".format(self.subnet_id)
 
-    @base.Base.cached_property
+    @classmethod
+    def describe_many(cls, conn, names):
+        return {el['SubnetId']: el for el in conn.describe_subnets(SubnetIds=list(names))['Subnets']}
+
+    @base.Base.cached_property(persistent=True)
     def describe(self):
-        return self.conn.describe_subnets(SubnetIds=[self.subnet_id])['Subnets'][0]
+        return self.describe_with_siblings()
 
     @property
     def availability_zone(self):
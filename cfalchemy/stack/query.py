@@ -0,0 +1,146 @@
+"""Queries for stack resources of particular type"""
+from enum import Enum
+
+# CloudFormation tags all resources it creates with the name of the stack
+STACK_NAME_TAG = 'aws:cloudformation:stack-name'
+
+
+class Query(object):
+    """Query for the stack resources of one type.
+
+    Criteria are passed as keyword arguments to `filter()`, e.g. `.filter(state='running', tag={'role': 'web'})`.
+        Each criterion is a name of resource object attribute and the value (or a list/tuple/set of any
+        acceptable values) it should have. The special 'tag' criterion accepts a {<tag key>: <value>} dict.
+
+    Criteria that AWS can evaluate (see `StackResource.query_filters`) are compiled to the `Filters` of
+        the `describe_filtered()` call of the resource class, the rest are evaluated in memory.
+    """
+
+    def __init__(self, stack, resource_cls, criteria=None):
+        self.stack = stack
+        self.resource_cls = resource_cls
+        self.criteria = dict(criteria or {})
+
+    def filter(self, **criteria):
+        """Return new query with additional criteria"""
+        new_criteria = dict(self.criteria)
+        for (name, value) in criteria.items():
+            if name == 'tag':
+                tags = dict(new_criteria.get('tag', {}))
+                tags.update(value)
+                value = tags
+            new_criteria[name] = value
+        return self.__class__(self.stack, self.resource_cls, new_criteria)
+
+    def all(self):
+        return tuple(self)
+
+    def first(self, default=None):
+        for el in self:
+            return el
+        return default
+
+    def stop(self, max_workers=8):
+        """Stop all matching resources, see `Stack.stop()`"""
+        return self.stack.stop(self, max_workers=max_workers)
+
+    def start(self, max_workers=8):
+        """Start all matching resources, see `Stack.start()`"""
+        return self.stack.start(self, max_workers=max_workers)
+
+    def wait_until(self, state, timeout=None):
+        """Wait until all matching resources reach the `state`, see `Stack.wait_until()`"""
+        return self.stack.wait_until(self, state, timeout=timeout)
+
+    def __iter__(self):
+        (aws_criteria, local_criteria) = self._split_criteria()
+        candidates = [
+            res.resource
+            for res in self.stack.resources_by_type(self.resource_cls.resource_type)
+        ]
+        if aws_criteria is None:
+            # Resource type doesn't support AWS-side filtering
+            self.resource_cls.load_many(candidates)
+            found = candidates
+        else:
+            found = self._describe_filtered(candidates, aws_criteria)
+
+        for obj in found:
+            if all(self._matches(obj, name, value) for (name, value) in local_criteria.items()):
+                yield obj
+
+    def _split_criteria(self):
+        """Return (<criteria evaluated by AWS>, <criteria evaluated in memory>)
+
+        First element is None if the resource class does not support AWS-side filtering.
+        """
+        cls = self.resource_cls
+        if not cls.query_filters:
+            return (None, self.criteria)
+        aws_criteria = {}
+        local_criteria = {}
+        for (name, value) in self.criteria.items():
+            if name in cls.query_filters or (name == 'tag' and cls.tag_query_filter):
+                aws_criteria[name] = value
+            else:
+                local_criteria[name] = value
+        return (aws_criteria, local_criteria)
+
+    def _describe_filtered(self, candidates, aws_criteria):
+        cls = self.resource_cls
+        filters = []
+        if cls.tag_query_filter:
+            # Only resources of this stack are of interest
+            filters.append(self._mk_filter(cls.tag_query_filter.format(STACK_NAME_TAG), self.stack.name))
+        for (name, value) in aws_criteria.items():
+            if name == 'tag':
+                filters.extend(
+                    self._mk_filter(cls.tag_query_filter.format(tag_key), tag_value)
+                    for (tag_key, tag_value) in value.items()
+                )
+            else:
+                filters.append(self._mk_filter(cls.query_filters[name], value))
+
+        describes = cls.describe_filtered(self.stack.boto_client(cls.boto_service_name), filters)
+        out = []
+        for obj in candidates:
+            if obj.name in describes:
+                obj.prime_cache('describe', describes[obj.name])
+                out.append(obj)
+        return out
+
+    def _mk_filter(self, aws_name, value):
+        return {
+            'Name': aws_name,
+            'Values': [
+                self.resource_cls.query_filter_value(el)
+                for el in _as_tuple(value)
+            ],
+        }
+
+    def _matches(self, obj, name, value):
+        if name == 'tag':
+            tags = obj.tags
+            return all(
+                key in tags and tags[key] in _as_tuple(tag_value)
+                for (key, tag_value) in value.items()
+            )
+        actual = getattr(obj, name)
+        for expected in _as_tuple(value):
+            if actual == expected or (isinstance(actual, Enum) and actual.name == expected):
+                return True
+        return False
+
+    def __repr__(self):
+        return '<{}.{} {} criteria={!r}>'.format(
+            self.__module__,
+            self.__class__.__name__,
+            self.resource_cls.resource_type,
+            self.criteria,
+        )
+
+
+def _as_tuple(value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(value)
+    return (value, )
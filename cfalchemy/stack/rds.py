@@ -3,18 +3,30 @@ from . import base
 
 class DBInstance(base.StackResource):
 
+    __slots__ = ()
+
     resource_type = 'AWS::RDS::DBInstance'
     boto_service_name = 'rds'
 
+    # Max number of values of the 'db-instance-id' filter
+    describe_batch_size = 100
+
     @property
     def instance_id(self):
         return self.name
 
-    @base.Base.cached_property
+    @classmethod
+    def describe_many(cls, conn, names):
+        out = {}
+        paginator = conn.get_paginator('describe_db_instances')
+        for page in paginator.paginate(Filters=[{'Name': 'db-instance-id', 'Values': list(names)}]):
+            for instance in page['DBInstances']:
+                out[instance['DBInstanceIdentifier']] = instance
+        return out
+
+    @base.Base.cached_property(persistent=True)
     def describe(self):
-        data = self.conn.describe_db_instances(DBInstanceIdentifier=self.instance_id)
-        assert len(data['DBInstances']) == 1
-        return data['DBInstances'][0]
+        return self.describe_with_siblings()
 
     @base.Base.cached_property
     def arn(self):
@@ -32,11 +44,18 @@ class DBInstance(base.StackResource):
     def port(self):
         return self.describe['Endpoint']['Port']
 
+    @property
+    def status(self):
+        return self.describe['DBInstanceStatus']
+
+    available = property(lambda self: self.status == 'available')
+    stopped = property(lambda self: self.status == 'stopped')
+
     @base.StackResource.cached_property
     def tags(self):
         return base.AwsDict(
             'Key', 'Value',
-            getter=lambda: self.conn.list_tags_for_resource(ResourceName=self.arn)['TagList'],
+            getter=self._get_tag_list,
             setter=lambda els: self.conn.add_tags_to_resource(
                 ResourceName=self.arn,
                 Tags=list(els)
@@ -44,17 +63,28 @@ class DBInstance(base.StackResource):
             deleter=lambda els: self.conn.remove_tags_from_resource(
                 ResourceName=self.arn,
                 TagKeys=list(el['Key'] for el in els)
-            )
+            ),
+            on_cache_purged=lambda: self.clear_cache(),
+            write_through=self.write_through_tags,
+            on_committed=lambda tags: self._update_described_tags(tags, key='TagList'),
+            committer=self._tag_committer,
         )
 
+    def _get_tag_list(self):
+        describe = self.describe
+        if 'TagList' in describe:
+            # Recent API versions return tags along with the describe data
+            return describe['TagList']
+        return self.conn.list_tags_for_resource(ResourceName=self.arn)['TagList']
+
     def stop(self):
         try:
             self.conn.stop_db_instance(DBInstanceIdentifier=self.instance_id)
         finally:
-            self.clear_cache()
+            self.invalidate(*self.lifecycle_cached_properties)
 
     def start(self):
         try:
             self.conn.start_db_instance(DBInstanceIdentifier=self.instance_id)
         finally:
-            self.clear_cache()
+            self.invalidate(*self.lifecycle_cached_properties)
@@ -0,0 +1,212 @@
+"""Deferred tag writes batched across resources"""
+import collections
+import itertools
+import logging
+import threading
+import time
+
+import botocore.exceptions
+import concurrent.futures
+
+log = logging.getLogger(__name__)
+
+
+class UnitOfWork(object):
+    """Collects tag commits of the stack resources and writes them with as few AWS calls as possible.
+
+    Commits are deferred to the unit of work while it is active (see `Stack.unit_of_work()`),
+        `flush()` writes them grouped by resource class (see `StackResource.write_tags_many()`).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {id(<tag dict>): (<resource>, <tag dict>)}
+        self._pending = collections.OrderedDict()
+
+    def defer(self, resource, aws_dict):
+        """Schedule deferred commits of the resource's `aws_dict` to be written by `flush()`"""
+        with self._lock:
+            self._pending[id(aws_dict)] = (resource, aws_dict)
+
+    def flush(self):
+        """Write all deferred commits.
+
+        Raises the first error encountered after all the writes were attempted,
+            the caches of the resources that failed to be written are purged.
+        """
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        errors = write_deferred(pending, self._call)
+        if errors:
+            raise errors[0]
+
+    def discard(self):
+        """Drop all deferred commits without writing them"""
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for (_, aws_dict) in pending:
+            (snapshot, _, _) = aws_dict.take_deferred()
+            aws_dict.drop_deferred(snapshot)
+
+    def _call(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __repr__(self):
+        return '<{}.{} pending={}>'.format(self.__module__, self.__class__.__name__, len(self))
+
+
+class WriteBehindQueue(UnitOfWork):
+    """Unit of work that writes the deferred tag commits in a background thread.
+
+    Writes are collected for `delay` seconds, so repeated writes of the same key are coalesced and the writes
+        of many resources are batched. Throttled AWS calls are retried up to `max_retries` times.
+    Use `future()` or `flush()` when the writes have to be durable.
+    """
+
+    # AWS error codes of the throttled calls
+    RETRYABLE_ERRORS = frozenset(['Throttling', 'ThrottlingException', 'RequestLimitExceeded'])
+
+    def __init__(self, delay=0.5, max_retries=5, retry_delay=0.5):
+        super(WriteBehindQueue, self).__init__()
+        self.delay = delay
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._cond = threading.Condition(self._lock)
+        self._future = concurrent.futures.Future()
+        # Future of the writes being made by the flusher thread
+        self._in_flight = None
+        self._flush_requested = False
+        self._closed = False
+        self._thread = None
+
+    def defer(self, resource, aws_dict):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('{!r} is closed'.format(self))
+            self._pending[id(aws_dict)] = (resource, aws_dict)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='cfalchemy-write-behind')
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify_all()
+
+    def future(self):
+        """Return `concurrent.futures.Future` that is done once all writes deferred so far are written"""
+        with self._cond:
+            if self._pending:
+                return self._future
+            if self._in_flight is not None:
+                return self._in_flight
+        done = concurrent.futures.Future()
+        done.set_result(None)
+        return done
+
+    def flush(self, timeout=None):
+        """Write all deferred commits now and wait for them, raises the first write error"""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+        self.future().result(timeout)
+
+    def close(self, timeout=None):
+        """Flush the queue and stop the flusher thread. Tag writes can't be deferred to a closed queue."""
+        with self._cond:
+            self._closed = True
+            thread = self._thread
+        try:
+            self.flush(timeout)
+        finally:
+            with self._cond:
+                self._cond.notify_all()
+            if thread is not None:
+                thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not (self._pending or self._closed):
+                    self._cond.wait()
+                if not self._pending:
+                    self._thread = None
+                    return
+                # Give other writes a chance to join the batch
+                deadline = time.time() + self.delay
+                while not (self._flush_requested or self._closed) and time.time() < deadline:
+                    self._cond.wait(deadline - time.time())
+                pending = list(self._pending.values())
+                self._pending.clear()
+                self._in_flight = future = self._future
+                self._future = concurrent.futures.Future()
+                self._flush_requested = False
+
+            try:
+                errors = write_deferred(pending, self._call)
+            except Exception as err:
+                log.exception('Write-behind flush failed')
+                errors = [err]
+            with self._cond:
+                if self._in_flight is future:
+                    self._in_flight = None
+            if errors:
+                future.set_exception(errors[0])
+            else:
+                future.set_result(None)
+
+    def _call(self, func, *args, **kwargs):
+        for attempt in itertools.count():
+            try:
+                return func(*args, **kwargs)
+            except botocore.exceptions.ClientError as err:
+                code = err.response.get('Error', {}).get('Code')
+                if code not in self.RETRYABLE_ERRORS or attempt >= self.max_retries:
+                    raise
+                log.info('Tag write throttled, retrying ({}/{})'.format(attempt + 1, self.max_retries))
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+
+def write_deferred(pending, call):
+    """Write deferred commits of [(<resource>, <tag dict>), ...].
+
+    Resources of the classes that support batched tag writes are written with `write_tags_many()`,
+        the rest one by one. `call(func, *args, **kwargs)` is used to make the AWS calls.
+    Returns list of exceptions raised by the failed writes.
+    """
+    # {(<resource class>, <boto client>): [(<resource>, <tag dict>, <snapshot>, <to set>, <to delete>), ...]}
+    groups = collections.OrderedDict()
+    for (resource, aws_dict) in pending:
+        (snapshot, to_set, to_delete) = aws_dict.take_deferred()
+        if not snapshot:
+            continue
+        key = (resource.__class__, resource.conn)
+        groups.setdefault(key, []).append((resource, aws_dict, snapshot, to_set, to_delete))
+
+    errors = []
+    for ((cls, conn), writes) in groups.items():
+        if cls.tag_batch_size is None:
+            for (resource, aws_dict, snapshot, to_set, to_delete) in writes:
+                _write(errors, [(aws_dict, snapshot)], call, aws_dict.write, to_set, to_delete)
+        else:
+            _write(
+                errors, [(aws_dict, snapshot) for (_, aws_dict, snapshot, _, _) in writes],
+                call, cls.write_tags_many, conn,
+                [(resource.name, to_set, to_delete) for (resource, _, _, to_set, to_delete) in writes],
+            )
+    return errors
+
+
+def _write(errors, written, call, func, *args):
+    try:
+        call(func, *args)
+    except Exception as err:
+        log.exception('Deferred tag write failed')
+        errors.append(err)
+        for (aws_dict, snapshot) in written:
+            aws_dict.deferred_failed(snapshot)
+    else:
+        for (aws_dict, snapshot) in written:
+            aws_dict.deferred_written(snapshot)
@@ -0,0 +1,182 @@
+"""Waiting for many resources to reach a state with batched polling"""
+import collections
+import logging
+import random
+import threading
+import time
+from enum import Enum
+
+import botocore.exceptions
+import concurrent.futures
+import six
+
+from . import unit_of_work as cf_unit_of_work
+
+log = logging.getLogger(__name__)
+
+
+class WaitTimeout(Exception):
+    """Resource didn't reach the awaited state in time"""
+
+    def __init__(self, resource, state):
+        super(WaitTimeout, self).__init__('{!r} did not reach state {!r} in time'.format(resource, state))
+        self.resource = resource
+        self.state = state
+
+
+def state_predicate(state):
+    """Return predicate(<resource object>) of the `state` accepted by `Stack.wait_until()`.
+
+    `state` is either a name of boolean attribute of the resource (e.g. 'running' or 'converged'),
+        a member of the state enum (e.g. `InstanceState.stopped`) compared with the `state` attribute,
+        or a callable accepting the resource object.
+    """
+    if isinstance(state, six.string_types):
+        return lambda obj: bool(getattr(obj, state))
+    if isinstance(state, Enum):
+        return lambda obj: obj.state == state
+    if callable(state):
+        return state
+    raise TypeError('Unsupported state {!r}'.format(state))
+
+
+class _Watch(object):
+
+    __slots__ = ('resource', 'state', 'predicate', 'deadline', 'future', 'failed_polls')
+
+    def __init__(self, resource, state, predicate, deadline, future):
+        self.resource = resource
+        self.state = state
+        self.predicate = predicate
+        self.deadline = deadline
+        self.future = future
+        # Number of consecutive polls that failed with a retryable error
+        self.failed_polls = 0
+
+
+class Poller(object):
+    """Polls states of the watched resources in a background thread.
+
+    On each tick all watched resources of a type are described with one batched call (see
+        `StackResource.describe_batch()`). The delay between the ticks starts at `min_delay` seconds and
+        grows `backoff` times up to `max_delay`, each delay is randomized by +-`jitter` fraction of it.
+    A watch fails with the describe error if it isn't retryable (e.g. AccessDenied, unknown resource)
+        or once `max_failed_polls` consecutive polls fail with a throttling error. A failed batch counts as
+        a failed poll of all its resources, the delays keep growing meanwhile.
+    """
+
+    RETRYABLE_ERRORS = cf_unit_of_work.WriteBehindQueue.RETRYABLE_ERRORS
+
+    def __init__(self, min_delay=1.0, max_delay=30.0, backoff=2.0, jitter=0.2, max_failed_polls=5):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.jitter = jitter
+        self.max_failed_polls = max_failed_polls
+        self._cond = threading.Condition(threading.Lock())
+        self._watches = []
+        self._delay = min_delay
+        self._thread = None
+
+    def watch(self, resource, state, timeout=None):
+        """Return `concurrent.futures.Future` resolved with the `resource` once it reaches the `state`.
+
+        The future fails with `WaitTimeout` if the state isn't reached in `timeout` seconds.
+        """
+        predicate = state_predicate(state)
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            self._watches.append(_Watch(resource, state, predicate, deadline, future))
+            # Poll the new resources early
+            self._delay = self.min_delay
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='cfalchemy-poller')
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify_all()
+        return future
+
+    def __len__(self):
+        return len(self._watches)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                watches = list(self._watches)
+            try:
+                self._poll(watches)
+            except Exception:
+                log.exception('Polling failed')
+            with self._cond:
+                self._watches = [el for el in self._watches if not el.future.done()]
+                if not self._watches:
+                    self._thread = None
+                    return
+                delay = self._delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+                self._delay = min(self._delay * self.backoff, self.max_delay)
+                deadlines = [el.deadline for el in self._watches if el.deadline is not None]
+                if deadlines:
+                    # Wake up in time to fail the expired watches
+                    delay = min(delay, max(min(deadlines) - time.time(), 0))
+                self._cond.wait(delay)
+
+    def _poll(self, watches):
+        # {(<resource class>, <boto client>): [<watch>, ...]}
+        groups = collections.OrderedDict()
+        for watch in watches:
+            if not watch.future.done():
+                groups.setdefault((watch.resource.__class__, watch.resource.conn), []).append(watch)
+
+        for ((cls, _), group) in groups.items():
+            objects = list(collections.OrderedDict((id(el.resource), el.resource) for el in group).values())
+            for obj in objects:
+                obj.invalidate(*obj.lifecycle_cached_properties)
+            # {id(<resource>): <exception raised by its describe>}
+            errors = {}
+            if cls.describe_batch_size is not None:
+                try:
+                    cls.load_many(objects)
+                except Exception as err:
+                    # The poll failed for the whole group, describing the resources one by one would only
+                    #   multiply the calls (e.g. of a throttled API)
+                    log.info('Batched describe of {} resources failed: {!r}'.format(len(objects), err))
+                    errors = dict((id(obj), err) for obj in objects)
+            for obj in objects:
+                if id(obj) in errors or obj.is_cached('describe'):
+                    continue
+                # Not described in batch (unknown id or no batch API) - describe it on its own to get the error
+                try:
+                    obj.describe
+                except Exception as err:
+                    log.info('Describe of {!r} failed: {!r}'.format(obj, err))
+                    errors[id(obj)] = err
+
+            now = time.time()
+            for watch in group:
+                err = errors.get(id(watch.resource))
+                if err is not None:
+                    watch.failed_polls += 1
+                    if not self._is_retryable(err) or watch.failed_polls >= self.max_failed_polls:
+                        watch.future.set_exception(err)
+                        continue
+                else:
+                    watch.failed_polls = 0
+                    try:
+                        if watch.predicate(watch.resource):
+                            watch.future.set_result(watch.resource)
+                            continue
+                    except Exception as err:
+                        watch.future.set_exception(err)
+                        continue
+                if watch.deadline is not None and now >= watch.deadline:
+                    watch.future.set_exception(WaitTimeout(watch.resource, watch.state))
+
+    def _is_retryable(self, err):
+        if not isinstance(err, botocore.exceptions.ClientError):
+            return False
+        return err.response.get('Error', {}).get('Code') in self.RETRYABLE_ERRORS
+
+    def __repr__(self):
+        return '<{}.{} watches={}>'.format(self.__module__, self.__class__.__name__, len(self))
@@ -49,5 +49,6 @@ setup(
         'cached_property',
         'frozendict>=1.2',
         'enum34>=1.1.6',
+        'futures>=3.2; python_version < "3"',
     ]
 )
@@ -191,6 +191,81 @@ class TestAwsAdvancedDict:
             assert 'val2' not in tested
             assert len(tested) == orig_len - 1
 
+    def test_layered_reads(self):
+        tested = aws_dict.AwsAdvancedDict('KeyEl', self.default_getter, mock.MagicMock(), mock.MagicMock())
+        tested.prefetch()
+        no_copies = mock.patch.object(
+            aws_dict.AwsAdvancedDict, 'remote_items', new_callable=mock.PropertyMock,
+            side_effect=AssertionError('Reads should not copy remote items'),
+        )
+        with no_copies:
+            assert tested['val1']['ValEl'] == 'val1'
+            assert sorted(tested) == ['val1', 'val2', 'val3', 'val4']
+        with tested.bulk_update():
+            tested['val1'] = {'ValEl': 'outer'}
+            tested['new'] = {'ValEl': 'new'}
+            with tested.bulk_update():
+                tested['val1'] = {'ValEl': 'inner'}
+                del tested['val3']
+                del tested['missing']
+
+                with no_copies:
+                    assert tested['val1']['ValEl'] == 'inner'
+                    assert tested['new']['ValEl'] == 'new'
+                    with pytest.raises(KeyError):
+                        tested['val3']
+                    assert sorted(tested) == ['new', 'val1', 'val2', 'val4']
+                    assert len(tested) == 4
+            assert sorted(tested.current_items_view) == ['new', 'val1', 'val2', 'val4']
+
+    def test_noop_writes_skipped(self):
+        setter = mock.MagicMock()
+        deleter = mock.MagicMock()
+        on_purge = mock.MagicMock()
+        tested = aws_dict.AwsAdvancedDict('KeyEl', self.default_getter, setter, deleter, on_purge)
+
+        summary = tested.update(
+            val1={'ValEl': 'val1', 'PropEl': 'prop1'},
+            val2={'ValEl': 'changed', 'PropEl': 'prop2'},
+            val3=None,
+            missing=None,
+        )
+        assert summary == aws_dict.CommitSummary(('val2', ), ('val3', ), ('missing', 'val1'))
+        assert tested.last_commit == summary
+        setter.assert_called_once_with([{'KeyEl': 'val2', 'ValEl': 'changed', 'PropEl': 'prop2'}])
+        deleter.assert_called_once_with([{'KeyEl': 'val3'}])
+        assert on_purge.call_count == 1
+
+        with tested.bulk_update():
+            tested['val1'] = {'ValEl': 'val1', 'PropEl': 'prop1'}
+            del tested['missing']
+        assert tested.last_commit == aws_dict.CommitSummary((), (), ('missing', 'val1'))
+        assert setter.call_count == 1
+        assert deleter.call_count == 1
+        # Nothing was written, cache is still valid
+        assert on_purge.call_count == 1
+
+    def test_write_through(self):
+        getter = mock.MagicMock(side_effect=self.default_getter)
+        on_purge = mock.MagicMock()
+        on_committed = mock.MagicMock()
+        tested = aws_dict.AwsAdvancedDict(
+            'KeyEl', getter, mock.MagicMock(), mock.MagicMock(), on_purge,
+            write_through=True, on_committed=on_committed,
+        )
+        tested.update(val1={'ValEl': 'changed'}, val2=None, new={'ValEl': 'new'})
+
+        assert not on_purge.called
+        assert getter.call_count == 1
+        assert tested['val1'] == {'ValEl': 'changed'}
+        assert sorted(tested) == ['new', 'val1', 'val3', 'val4']
+        assert unordered_equal(on_committed.call_args[0][0], [
+            {'KeyEl': 'val1', 'ValEl': 'changed'},
+            {'KeyEl': 'val3', 'ValEl': 'val3', 'PropEl': 'prop3'},
+            {'KeyEl': 'val4', 'ValEl': 'val4', 'PropEl': 'prop4'},
+            {'KeyEl': 'new', 'ValEl': 'new'},
+        ])
+
     def test_cb_setters(self):
         setter = mock.MagicMock()
         deleter = mock.MagicMock()
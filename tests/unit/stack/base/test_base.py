@@ -1,6 +1,9 @@
 """Test stack.base module"""
 
-# import mock
+import threading
+import time
+
+import mock
 import pytest
 
 import cfalchemy.stack.base
@@ -90,3 +93,171 @@ class TestCachedProps:
         assert obj.prop2 == 5
         assert obj.prop1 == 6
         assert obj.prop1 == 6
+
+    def test_invalidate(self, obj):
+        assert obj.prop1 == 1
+        assert obj.prop2 == 2
+        obj.invalidate('prop1')
+        assert not obj.is_cached('prop1')
+        assert obj.is_cached('prop2')
+        assert obj.prop1 == 3
+        del obj.prop2
+        assert obj.prop2 == 4
+
+    def test_read_only(self, obj):
+        with pytest.raises(AttributeError):
+            obj.prop1 = 42
+
+    def test_prime_cache(self, obj):
+        obj.prime_cache('prop2', 'primed')
+        assert obj.is_cached('prop2')
+        assert obj.prop2 == 'primed'
+        assert obj._counter == 0
+
+
+class TtlPropsBase(BoundUUidBase):
+
+    _counter = 0
+    ttl_overrides = {}
+
+    def get_cache_ttl(self, name, default):
+        return self.ttl_overrides.get(name, default)
+
+    @cfalchemy.stack.base.Base.cached_property(ttl=10)
+    def short_lived(self):
+        self._counter += 1
+        return self._counter
+
+    @cfalchemy.stack.base.Base.cached_property
+    def long_lived(self):
+        self._counter += 1
+        return self._counter
+
+
+class TestCachedPropsTtl:
+
+    @pytest.fixture
+    def clock(self):
+        with mock.patch('cfalchemy.stack.base.base.monotonic') as clock_mock:
+            clock_mock.return_value = 1000
+            yield clock_mock
+
+    def test_expiry(self, clock):
+        obj = TtlPropsBase('uuid-42')
+        assert obj.short_lived == 1
+        assert obj.long_lived == 2
+        assert obj._cached_properties == {'short_lived': 1010, 'long_lived': None}
+
+        clock.return_value = 1009
+        assert obj.short_lived == 1
+        clock.return_value = 1010
+        assert not obj.is_cached('short_lived')
+        assert obj.short_lived == 3
+        assert obj.long_lived == 2
+
+    def test_override(self, clock):
+        obj = TtlPropsBase('uuid-42')
+        obj.ttl_overrides = {'short_lived': None, 'long_lived': 5}
+        assert obj.short_lived == 1
+        assert obj.long_lived == 2
+        clock.return_value = 1100
+        assert obj.short_lived == 1
+        assert obj.long_lived == 3
+
+
+class Interrupted(BaseException):
+    """Stands in for KeyboardInterrupt/SystemExit"""
+
+
+class SlowPropsBase(BoundUUidBase):
+
+    def __init__(self, uuid, fail=None):
+        super(SlowPropsBase, self).__init__(uuid)
+        self.fail = fail
+        self.calls = 0
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    @cfalchemy.stack.base.Base.cached_property
+    def slow(self):
+        self.calls += 1
+        self.entered.set()
+        self.release.wait(5)
+        if self.fail:
+            raise self.fail('boom')
+        return self.calls
+
+
+class TestSingleFlight:
+
+    def _run_concurrently(self, obj, nr_threads=8):
+        results = []
+
+        def _get():
+            try:
+                results.append(obj.slow)
+            except BaseException as exc:
+                results.append(exc)
+
+        threads = [threading.Thread(target=_get) for _ in range(nr_threads)]
+        threads[0].start()
+        # Let the first thread become the leader, the rest has to wait for it
+        assert obj.entered.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        obj.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_computed_once(self):
+        obj = SlowPropsBase('uuid-1')
+        assert self._run_concurrently(obj) == [1] * 8
+        assert obj.calls == 1
+        assert obj.slow == 1
+        assert not obj._flights
+
+    def test_exception_shared(self):
+        obj = SlowPropsBase('uuid-1', fail=ValueError)
+        results = self._run_concurrently(obj)
+        assert len(results) == 8
+        assert all(isinstance(el, ValueError) for el in results)
+        assert obj.calls == 1
+        assert not obj.is_cached('slow')
+
+    def test_base_exception_releases_waiters(self):
+        obj = SlowPropsBase('uuid-1', fail=Interrupted)
+        results = self._run_concurrently(obj, nr_threads=4)
+        assert len(results) == 4
+        assert all(isinstance(el, Interrupted) for el in results)
+        assert not obj._flights
+
+    def test_invalidated_during_load(self):
+        obj = SlowPropsBase('uuid-1')
+        thread = threading.Thread(target=lambda: obj.slow)
+        thread.start()
+        assert obj.entered.wait(5)
+        obj.invalidate('slow')
+        obj.release.set()
+        thread.join(5)
+        # Value loaded before the invalidation is not cached
+        assert not obj.is_cached('slow')
+        assert obj.slow == 2
+
+    def test_no_join_after_invalidation(self):
+        obj = SlowPropsBase('uuid-1')
+        threads = [threading.Thread(target=lambda: obj.slow) for _ in range(2)]
+        threads[0].start()
+        assert obj.entered.wait(5)
+        obj.invalidate('slow')
+        # The load started before the invalidation isn't joined, a fresh one is started
+        threads[1].start()
+        deadline = time.time() + 5
+        while obj.calls < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        obj.release.set()
+        for thread in threads:
+            thread.join(5)
+        assert obj.calls == 2
+        assert obj.is_cached('slow')
+        assert not obj._flights
@@ -4,6 +4,8 @@ import contextlib
 import pytest
 import mock
 
+from tests.unit import util
+
 
 class FakeAwsEnv:
 
@@ -33,18 +35,30 @@ class FakeAwsEnv:
             rv = getattr(self.client_mock, name)
             for (name, params) in config.items():
                 mock_handle = getattr(rv, name)
-                mock_handle.side_effect = self._mk_bound_side_effect(mock_handle, params)
+                if name == 'get_paginator':
+                    mock_handle.side_effect = self._mk_paginator_side_effect(rv, params)
+                else:
+                    mock_handle.side_effect = self._mk_bound_side_effect(mock_handle, params)
         else:
             # No config - return the default return value
             rv = self.client_mock.default
         return rv
 
+    def _mk_paginator_side_effect(self, client_mock, paginators):
+        """Paginator config is {<operation name>: <callable accepting paginate() kwargs returning list of pages>}"""
+        def _get_paginator(operation_name):
+            paginator = getattr(client_mock.paginators, operation_name)
+            paginator.paginate.side_effect = lambda *a, **kw: iter(paginators[operation_name](**kw))
+            return paginator
+        return _get_paginator
+
     def _mk_bound_side_effect(self, mock_handle, params):
-        return lambda *a, **kw: self._get_module_side_effect(mock_handle, params)
+        """Config is <callable accepting the call kwargs returning the response>"""
+        return lambda *a, **kw: self._get_module_side_effect(mock_handle, params, kw)
 
-    def _get_module_side_effect(self, api_mock, mock_params):
+    def _get_module_side_effect(self, api_mock, mock_params, kwargs):
         if callable(mock_params):
-            rv = mock_params()
+            rv = mock_params(**kwargs)
         else:
             raise NotImplementedError(api_mock)
         return rv
@@ -61,23 +75,43 @@ def default_fake_aws_env(fake_aws_env, fake_boto3):
     """Default fake AWS envitonemnt"""
     fake_aws_env.update({
         'cloudformation': {
-            'describe_stacks': lambda: fake_boto3.load_resoruce('cloudformation', 'describe_stacks'),
-            'describe_stack_resources': lambda: fake_boto3.load_resoruce('cloudformation', 'describe_stack_resources'),
+            'describe_stacks': lambda **kwargs: fake_boto3.load_resoruce('cloudformation', 'describe_stacks'),
+            'get_paginator': {
+                'list_stack_resources': lambda **kwargs: fake_boto3.load_resoruce(
+                    'cloudformation', 'list_stack_resources'
+                ),
+            },
         },
         'ec2': {
-            'describe_instances': lambda: fake_boto3.load_resoruce('ec2', 'describe_instances'),
-            'describe_subnets': lambda: fake_boto3.load_resoruce('ec2', 'describe_subnets'),
+            'describe_instances': lambda **kwargs: fake_boto3.load_resoruce('ec2', 'describe_instances'),
+            'describe_subnets': lambda SubnetIds: util.fake_describe_subnets(
+                fake_boto3.load_resoruce('ec2', 'describe_subnets'), SubnetIds
+            ),
         },
         'rds': {
-            'describe_db_instances': lambda: fake_boto3.load_resoruce('rds', 'describe_db_instances'),
-            'list_tags_for_resource': lambda: fake_boto3.load_resoruce('rds', 'list_tags_for_resource'),
+            'describe_db_instances': lambda **kwargs: fake_boto3.load_resoruce('rds', 'describe_db_instances'),
+            'get_paginator': {
+                'describe_db_instances': lambda **kwargs: [fake_boto3.load_resoruce('rds', 'describe_db_instances')],
+            },
+            'list_tags_for_resource': lambda **kwargs: fake_boto3.load_resoruce('rds', 'list_tags_for_resource'),
+        },
+        'sts': {
+            'get_caller_identity': lambda **kwargs: {
+                'Account': '424242424242', 'Arn': 'arn:aws:iam::424242424242:user/tester', 'UserId': 'tester',
+            },
         },
         'autoscaling': {
-            'describe_auto_scaling_groups': lambda: fake_boto3.load_resoruce(
+            'describe_auto_scaling_groups': lambda **kwargs: fake_boto3.load_resoruce(
                 'autoscaling', 'describe_auto_scaling_groups'
             ),
+            'get_paginator': {
+                'describe_auto_scaling_groups': lambda AutoScalingGroupNames: [util.fake_describe_auto_scaling_groups(
+                    fake_boto3.load_resoruce('autoscaling', 'describe_auto_scaling_groups'), AutoScalingGroupNames
+                )],
+            },
         }
     })
+    fake_aws_env.client_mock.cloudformation.meta.region_name = 'eu-central-1'
     return fake_aws_env
 
 
@@ -0,0 +1,48 @@
+import pytest
+
+import cfalchemy
+
+asyncio = pytest.importorskip('asyncio')
+
+
+@pytest.fixture()
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def test_aclient(loop, default_fake_aws_env):
+    with default_fake_aws_env.activate():
+        stack = loop.run_until_complete(cfalchemy.aclient('hello-world', client_pool=cfalchemy.ClientPool()))
+    assert stack.name == 'hello-world'
+
+
+def test_concurrent_loads(loop, default_stack):
+    (resources, stack_describe) = loop.run_until_complete(asyncio.gather(
+        default_stack.aresources(),
+        default_stack.adescribe(),
+    ))
+    assert resources is default_stack.resources
+    assert stack_describe is default_stack.aws_describe
+
+    objects = [default_stack.resources[name].resource for name in ('Bastion', 'Database', 'DevToolsASG')]
+    describes = loop.run_until_complete(asyncio.gather(*[obj.adescribe() for obj in objects]))
+    assert describes == [obj.describe for obj in objects]
+    assert loop.run_until_complete(objects[0].aget('private_ip')) == '10.138.10.92'
+
+
+def test_tags_acommit(loop, default_stack):
+    instance = default_stack.resources['Bastion'].resource
+    loop.run_until_complete(instance.tags.aprefetch())
+    loop.run_until_complete(instance.tags.acommit({'hello': 'world', 'CreatedWith': None}))
+    instance.conn.create_tags.assert_called_once_with(
+        Resources=['i-007d05f94c3bb8027'],
+        Tags=[{'Key': 'hello', 'Value': 'world'}],
+    )
+    instance.conn.delete_tags.assert_called_once_with(
+        Resources=['i-007d05f94c3bb8027'],
+        Tags=[{'Key': 'CreatedWith'}],
+    )
@@ -3,6 +3,7 @@ import mock
 
 
 import cfalchemy.stack.autoscaling
+from tests.unit.util import fake_describe_instances
 
 
 class TestASG(object):
@@ -68,3 +69,40 @@ class TestASG(object):
         assert handle.protected_from_scale_in is False
         assert handle.instance_id == 'i-00ed09c06862f64eb'
         assert handle.instance.instance_id == handle.instance_id
+
+    def test_instance_objects_shared(self, my_asg, default_stack):
+        instance = my_asg.instances[0].instance
+        assert my_asg.instances[0].instance is instance
+        assert default_stack.resource_object(cfalchemy.stack.ec2.ECInstance, 'i-00ed09c06862f64eb') is instance
+
+
+class TestBatchedDescribe(object):
+
+    def test_groups_described_together(self, default_stack, default_fake_aws_env):
+        groups = default_stack.query(cfalchemy.stack.autoscaling.AutoScalingGroup).all()
+        assert len(groups) == 6
+        assert groups[0].describe['AutoScalingGroupName'] == groups[0].name
+
+        conn = default_fake_aws_env.client_mock.autoscaling
+        conn.get_paginator.assert_called_once_with('describe_auto_scaling_groups')
+        names = conn.paginators.describe_auto_scaling_groups.paginate.call_args[1]['AutoScalingGroupNames']
+        assert sorted(names) == sorted(el.name for el in groups)
+        assert all(el.is_cached('describe') for el in groups)
+        assert not conn.describe_auto_scaling_groups.called
+
+    def test_member_instances_described_together(self, default_stack):
+        asg = default_stack.resources['DevToolsASG'].resource
+        member_ids = ['i-00000000000000001', 'i-00000000000000002', 'i-00000000000000003']
+        describe = dict(asg.describe)
+        describe['Instances'] = [
+            dict(describe['Instances'][0], InstanceId=instance_id)
+            for instance_id in member_ids
+        ]
+        asg.prime_cache('describe', describe)
+        ec2_conn = default_stack.boto_client('ec2')
+        ec2_conn.describe_instances.side_effect = fake_describe_instances
+
+        instances = [handle.instance for handle in asg.instances]
+        assert [el.private_ip for el in instances] == ['ip-of-{}'.format(el) for el in member_ids]
+        ec2_conn.describe_instances.assert_called_once_with(InstanceIds=member_ids)
+        assert asg.load_instances() == tuple(instances)
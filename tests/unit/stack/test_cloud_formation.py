@@ -1,8 +1,17 @@
 """AWS::CloudFormation::* support"""
+import copy
+import datetime
+import threading
+import botocore.exceptions
+
+import mock
 import pytest
 import uuid
 
+import cfalchemy
 import cfalchemy.stack.cloud_formation as cf
+import cfalchemy.stack.ec2 as ec2
+from tests.unit.util import fake_describe_instances
 
 
 @pytest.fixture()
@@ -38,6 +47,40 @@ def test_stack_resources_accessor(my_stack):
         assert resource.logical_id == key
 
 
+def test_stack_resources_paginated(my_stack):
+    paginator = my_stack.conn.get_paginator('list_stack_resources')
+    assert len(my_stack.resources) == 79
+    paginator.paginate.assert_called_once_with(StackName='hello-world')
+    assert my_stack.aws_resources[0]['LogicalResourceId'] == 'AWSSubnet1'
+
+
+def test_iter_resources_streams(my_stack):
+    pages_fetched = []
+
+    def _pages():
+        pages_fetched.append(1)
+        yield {'StackResourceSummaries': [{'LogicalResourceId': 'Res1'}]}
+        pages_fetched.append(2)
+        yield {'StackResourceSummaries': [{'LogicalResourceId': 'Res2'}, {'LogicalResourceId': 'Res3'}]}
+
+    my_stack.aws_describe
+    my_stack.conn.get_paginator.side_effect = None
+    my_stack.conn.get_paginator.return_value.paginate.side_effect = lambda **kwargs: _pages()
+
+    resource_iter = my_stack.iter_resources()
+    assert next(resource_iter).logical_id == 'Res1'
+    assert pages_fetched == [1]
+    assert not my_stack.is_cached('resources')
+    assert [res.logical_id for res in resource_iter] == ['Res2', 'Res3']
+    assert pages_fetched == [1, 2]
+
+    # Resource cache populated once all pages are received
+    assert my_stack.is_cached('resources')
+    assert list(my_stack.resources) == ['Res1', 'Res2', 'Res3']
+    assert list(my_stack.iter_resources()) == list(my_stack.resources.values())
+    assert pages_fetched == [1, 2]
+
+
 def test_stack_resource(my_stack):
     logical_id = 'CeleryWorkerCPUAlarmLow'
     resource = my_stack.resources[logical_id]
@@ -55,6 +98,49 @@ def test_get_resource(my_stack):
     assert my_stack.resources[logical_id] is not my_stack.get_resource('CeleryWorkerScaleDownPolicy')
 
 
+def test_resources_by_type(my_stack):
+    instances = my_stack.resources_by_type('AWS::EC2::Instance')
+    assert [res.logical_id for res in instances] == ['Bastion', 'RabbitMq']
+    assert len(my_stack.resources_by_type('AWS::AutoScaling::AutoScalingGroup')) == 6
+    assert my_stack.resources_by_type('AWS::Nonexistent::Type') == ()
+
+
+def test_resource_indexes_cleared(my_stack):
+    assert my_stack.get_resource('i-007d05f94c3bb8027').logical_id == 'Bastion'
+    assert my_stack.resources_by_type('AWS::EC2::Instance')
+    my_stack.clear_cache()
+    assert not my_stack.is_cached('_resource_index')
+
+    my_stack.conn.get_paginator.side_effect = None
+    my_stack.conn.get_paginator.return_value.paginate.side_effect = lambda **kwargs: iter([
+        {'StackResourceSummaries': [
+            {'LogicalResourceId': 'Bastion', 'PhysicalResourceId': 'i-new', 'ResourceType': 'AWS::EC2::Instance'},
+        ]}
+    ])
+    assert my_stack.get_resource('i-new').logical_id == 'Bastion'
+    assert my_stack.get_resource('i-007d05f94c3bb8027', default=None) is None
+    assert len(my_stack.resources_by_type('AWS::EC2::Instance')) == 1
+
+
+def test_resource_objects_shared(default_stack):
+    import cfalchemy.stack.ec2 as ec2
+    bastion = default_stack.resources['Bastion']
+    assert default_stack.resource_object(ec2.ECInstance, 'i-007d05f94c3bb8027') is bastion.resource
+    bastion.invalidate('resource')
+    assert bastion.resource is default_stack.resource_object(ec2.ECInstance, 'i-007d05f94c3bb8027')
+
+
+def test_clear_cache_clears_resource_objects(default_stack):
+    instance = default_stack.resources['Bastion'].resource
+    instance.describe
+    default_stack.clear_cache()
+    assert not instance.is_cached('describe')
+    # The stack hands out the same object, but with fresh data
+    assert default_stack.resources['Bastion'].resource is instance
+    instance.describe
+    assert instance.conn.describe_instances.call_count == 2
+
+
 def test_get_resource_exc(my_stack):
     with pytest.raises(KeyError):
         my_stack.get_resource('i-dont-exist')
@@ -62,3 +148,412 @@ def test_get_resource_exc(my_stack):
 
 def test_get_resource_default(my_stack):
     assert my_stack.get_resource('i-dont-exist', default=None) is None
+
+
+def test_stack_resources_share_clients(default_stack):
+    instance = default_stack.resources['Bastion'].resource
+    subnet = default_stack.resources['PublicSubnet1'].resource
+    assert instance.conn is subnet.conn
+    assert default_stack.boto_client('cloudformation') is default_stack.conn
+
+
+class TestLoad(object):
+
+    def test_load_all(self, default_stack, default_fake_aws_env):
+        default_stack.resources['Bastion'].resource.conn.describe_instances.side_effect = fake_describe_instances
+        assert default_stack.load(with_tags=True) is default_stack
+        for logical_id in ('Bastion', 'RabbitMq', 'Database', 'DevToolsASG', 'PublicSubnet1'):
+            assert default_stack.resources[logical_id].resource.is_cached('describe'), logical_id
+
+        ec2 = default_fake_aws_env.client_mock.ec2
+        rds = default_fake_aws_env.client_mock.rds
+        assert ec2.describe_instances.call_count == 1
+        assert rds.list_tags_for_resource.call_count == 1
+
+        # All data is already loaded
+        assert default_stack.resources['Bastion'].resource.private_ip
+        assert dict(default_stack.resources['Database'].resource.tags)
+        assert ec2.describe_instances.call_count == 1
+        assert rds.list_tags_for_resource.call_count == 1
+
+    def test_load_types(self, default_stack):
+        default_stack.load(types=['AWS::EC2::Instance'])
+        assert default_stack.resources['Bastion'].resource.is_cached('describe')
+        assert not default_stack.resources['Database'].resource.is_cached('describe')
+
+    def test_client_preload(self, default_fake_aws_env):
+        with default_fake_aws_env.activate():
+            stack = cfalchemy.client(
+                'hello-world', client_pool=cfalchemy.ClientPool(), preload=['AWS::RDS::DBInstance']
+            )
+        assert stack.is_cached('aws_describe')
+        assert stack.resources['Database'].resource.is_cached('describe')
+        assert default_fake_aws_env.client_mock.rds.list_tags_for_resource.called
+
+    def test_hydrate(self, default_stack, default_fake_aws_env):
+        default_stack.resources['Bastion'].resource.conn.describe_instances.side_effect = fake_describe_instances
+        assert default_stack.hydrate(max_workers=4) == {}
+        for logical_id in ('Bastion', 'RabbitMq', 'Database', 'DevToolsASG', 'PublicSubnet1'):
+            obj = default_stack.resources[logical_id].resource
+            assert obj.is_cached('describe'), logical_id
+        assert default_fake_aws_env.client_mock.ec2.describe_instances.call_count == 1
+        assert default_fake_aws_env.client_mock.rds.list_tags_for_resource.call_count == 1
+
+    def test_hydrate_batch_failure(self, default_stack, default_fake_aws_env):
+        bastion = default_stack.resources['Bastion'].resource
+        not_found = botocore.exceptions.ClientError(
+            {'Error': {'Code': 'InvalidInstanceID.NotFound'}}, 'DescribeInstances'
+        )
+
+        def _describe(InstanceIds):
+            if bastion.name in InstanceIds:
+                raise not_found
+            return fake_describe_instances(InstanceIds)
+
+        conn = bastion.conn
+        conn.describe_instances.side_effect = _describe
+        errors = default_stack.hydrate(max_workers=4, types=['AWS::EC2::Instance'], with_tags=False)
+        assert errors == {'Bastion': not_found}
+        # Only the id AWS rejected on its own is left out of the later batches
+        instances = [res.resource for res in default_stack.resources_by_type('AWS::EC2::Instance')]
+        assert [obj.batch_excluded for obj in instances] == [obj is bastion for obj in instances]
+        conn.describe_instances.assert_called_with(InstanceIds=[bastion.name])
+
+    def test_hydrate_batch_error(self, default_stack, default_fake_aws_env):
+        def _describe(InstanceIds):
+            if len(InstanceIds) > 1:
+                raise botocore.exceptions.EndpointConnectionError(endpoint_url='https://ec2.amazonaws.com')
+            return fake_describe_instances(InstanceIds)
+
+        conn = default_stack.resources['Bastion'].resource.conn
+        conn.describe_instances.side_effect = _describe
+        assert default_stack.hydrate(max_workers=4, types=['AWS::EC2::Instance'], with_tags=False) == {}
+        instances = default_stack.resources_by_type('AWS::EC2::Instance')
+        # One failed batch, then one call per instance that doesn't resend the batch
+        assert conn.describe_instances.call_count == 1 + len(instances)
+        assert all(len(call[1]['InstanceIds']) == 1 for call in conn.describe_instances.call_args_list[1:])
+
+    def test_hydrate_errors(self, default_stack, default_fake_aws_env):
+        error = botocore.exceptions.ClientError({'Error': {'Code': 'AccessDenied'}}, 'DescribeDBInstances')
+        default_stack.resources['Database'].resource.conn.get_paginator.side_effect = error
+        default_stack.resources['Bastion'].resource.conn.describe_instances.side_effect = fake_describe_instances
+
+        errors = default_stack.hydrate(types=['AWS::RDS::DBInstance', 'AWS::EC2::Instance'], with_tags=False)
+        assert errors == {'Database': error}
+        assert default_stack.resources['Bastion'].resource.is_cached('describe')
+        assert not default_stack.resources['DevToolsASG'].resource.is_cached('describe')
+        assert not default_fake_aws_env.client_mock.rds.list_tags_for_resource.called
+
+
+class TestLifecycle(object):
+
+    def test_stop(self, default_stack):
+        instances = [default_stack.resources[name].resource for name in ('Bastion', 'RabbitMq')]
+        database = default_stack.resources['Database'].resource
+        for obj in instances + [database]:
+            obj.prime_cache('describe', {})
+            obj.prime_cache('dns_name', 'example.com')
+
+        assert default_stack.stop(['Bastion', instances[1], database]) == {}
+        instances[0].conn.stop_instances.assert_called_once_with(InstanceIds=[obj.name for obj in instances])
+        database.conn.stop_db_instance.assert_called_once_with(DBInstanceIdentifier=database.name)
+        for obj in instances + [database]:
+            # Only the state-related caches are invalidated
+            assert not obj.is_cached('describe')
+            assert obj.is_cached('dns_name')
+
+    def test_start_chunked(self, default_stack, monkeypatch):
+        monkeypatch.setattr(ec2.ECInstance, 'lifecycle_batch_size', 1)
+        instances = [default_stack.resources[name].resource for name in ('Bastion', 'RabbitMq')]
+        error = botocore.exceptions.ClientError({'Error': {'Code': 'IncorrectInstanceState'}}, 'StartInstances')
+        instances[0].conn.start_instances.side_effect = lambda InstanceIds: (
+            _raise(error) if InstanceIds == [instances[0].name] else None
+        )
+
+        assert default_stack.start(instances) == {instances[0].name: error}
+        assert sorted(call[1]['InstanceIds'] for call in instances[0].conn.start_instances.call_args_list) == sorted(
+            [obj.name] for obj in instances
+        )
+
+    def test_query(self, default_stack):
+        database = default_stack.resources['Database'].resource
+        assert default_stack.query('AWS::RDS::DBInstance').start() == {}
+        database.conn.start_db_instance.assert_called_once_with(DBInstanceIdentifier=database.name)
+
+    def test_unsupported(self, default_stack):
+        with pytest.raises(TypeError):
+            default_stack.stop(['DevToolsASG'])
+
+
+def _raise(error):
+    raise error
+
+
+class FakeStackTree(object):
+    """Fake cloudformation client for a tree of nested stacks"""
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.conn = mock.Mock(name='cloudformation')
+        self.conn.describe_stacks.side_effect = self.describe_stacks
+        self.conn.get_paginator.return_value.paginate.side_effect = self.list_stack_resources
+        self.on_list = {}
+
+    @staticmethod
+    def arn(name):
+        return 'arn:aws:cloudformation:eu-central-1:424242424242:stack/{}/479d5820-1842-12e8-88f7-500c52a6ce62'.format(
+            name
+        )
+
+    def _name(self, name_or_arn):
+        return name_or_arn.split('/')[1] if name_or_arn.startswith('arn:') else name_or_arn
+
+    def describe_stacks(self, StackName):
+        return {'Stacks': [{'StackId': self.arn(self._name(StackName))}]}
+
+    def list_stack_resources(self, StackName):
+        if StackName in self.on_list:
+            self.on_list[StackName]()
+        return [{
+            'StackResourceSummaries': [
+                {
+                    'LogicalResourceId': child,
+                    'PhysicalResourceId': self.arn(child),
+                    'ResourceType': 'AWS::CloudFormation::Stack',
+                }
+                for child in self.tree.get(StackName, ())
+            ]
+        }]
+
+    def mk_stack(self, name):
+        from cfalchemy.resource_registry import CFAlchemyResourceRegistry
+        client_pool = mock.Mock(name='ClientPool')
+        client_pool.get.return_value = self.conn
+        return cf.Stack(name, CFAlchemyResourceRegistry(), {}, client_pool=client_pool)
+
+
+class TestNestedStacks(object):
+
+    @pytest.fixture()
+    def fake_tree(self):
+        return FakeStackTree({
+            'root': ['child1', 'child2'],
+            'child1': ['grandchild1'],
+            'child2': ['grandchild2', 'grandchild3'],
+        })
+
+    def test_nested_stack_resource(self, fake_tree):
+        root = fake_tree.mk_stack('root')
+        child = root.resources['child1'].resource
+        assert isinstance(child, cf.Stack)
+        assert child.parent is root
+        assert child.client_pool is root.client_pool
+        assert child.registry is root.registry
+        assert child.identity_map is root.identity_map
+        assert root.nested_stack(fake_tree.arn('child1')) is child
+        assert child.name == 'child1'
+        assert child.nested_stacks[0].name == 'grandchild1'
+        assert root.nested_stacks == (child, root.resources['child2'].resource)
+
+    def test_walk(self, fake_tree):
+        root = fake_tree.mk_stack('root')
+        stacks = list(root.walk())
+        assert stacks[0] is root
+        assert sorted(stack.name for stack in stacks) == [
+            'child1', 'child2', 'grandchild1', 'grandchild2', 'grandchild3', 'root'
+        ]
+
+    def test_walk_is_concurrent(self, fake_tree):
+        # Each of the child stacks waits until its sibling starts loading
+        started = {'child1': threading.Event(), 'child2': threading.Event()}
+
+        def _wait_for(me, sibling):
+            started[me].set()
+            assert started[sibling].wait(5), 'Nested stacks are not loaded concurrently'
+
+        fake_tree.on_list['child1'] = lambda: _wait_for('child1', 'child2')
+        fake_tree.on_list['child2'] = lambda: _wait_for('child2', 'child1')
+        root = fake_tree.mk_stack('root')
+        assert len(list(root.walk(max_workers=2))) == 6
+
+    def test_load_skips_nested_stacks(self, fake_tree):
+        root = fake_tree.mk_stack('root')
+        root.load()
+        assert not root.resources['child1'].is_cached('resource')
+
+
+class TestPersistentCache(object):
+
+    @pytest.fixture()
+    def persistent_cache(self, tmpdir):
+        return cfalchemy.SqliteCache(str(tmpdir))
+
+    def mk_stack(self, env, persistent_cache):
+        from cfalchemy.resource_registry import CFAlchemyResourceRegistry
+        return cf.Stack('hello-world', CFAlchemyResourceRegistry(), {}, persistent_cache=persistent_cache)
+
+    def test_shared_between_stack_objects(self, default_fake_aws_env, persistent_cache):
+        with default_fake_aws_env.activate() as env:
+            stack1 = self.mk_stack(env, persistent_cache)
+            assert len(stack1.resources) == 79
+            assert stack1.resources['Bastion'].resource.private_ip == '10.138.10.92'
+
+            stack2 = self.mk_stack(env, persistent_cache)
+            assert stack2.name == 'hello-world'
+            assert len(stack2.resources) == 79
+            assert stack2.resources['Bastion'].resource.private_ip == '10.138.10.92'
+
+        cf_conn = env.client_mock.cloudformation
+        assert cf_conn.describe_stacks.call_count == 1
+        assert cf_conn.paginators.list_stack_resources.paginate.call_count == 1
+        assert env.client_mock.ec2.describe_instances.call_count == 1
+
+    def test_batched_loads_use_persistent_cache(self, default_fake_aws_env, persistent_cache):
+        default_fake_aws_env.resource_config['ec2']['describe_instances'] = fake_describe_instances
+        with default_fake_aws_env.activate() as env:
+            self.mk_stack(env, persistent_cache).load()
+            stack = self.mk_stack(env, persistent_cache)
+            stack.load()
+            assert stack.resources['Bastion'].resource.is_cached('describe')
+            # Siblings of a resource that isn't persisted are served from the persistent cache
+            subnet = self.mk_stack(env, persistent_cache).resources['PublicSubnet1'].resource
+            persistent_cache.delete(subnet.persistent_cache_key('describe'))
+            assert subnet.availability_zone == 'eu-central-1a'
+
+        assert env.client_mock.ec2.describe_instances.call_count == 1
+        assert env.client_mock.ec2.describe_subnets.call_count == 2
+        env.client_mock.ec2.describe_subnets.assert_called_with(SubnetIds=['subnet-dfffd2b4'])
+        assert env.client_mock.rds.paginators.describe_db_instances.paginate.call_count == 1
+        assert env.client_mock.autoscaling.paginators.describe_auto_scaling_groups.paginate.call_count == 1
+
+    def test_clear_cache_bypasses_persistent_cache(self, default_fake_aws_env, persistent_cache):
+        with default_fake_aws_env.activate() as env:
+            stack = self.mk_stack(env, persistent_cache)
+            instance = stack.resources['Bastion'].resource
+            instance.describe
+            instance.clear_cache()
+            instance.describe
+        assert env.client_mock.ec2.describe_instances.call_count == 2
+
+    def test_keys_bound_to_stack_version(self, default_fake_aws_env, persistent_cache):
+        with default_fake_aws_env.activate() as env:
+            stack = self.mk_stack(env, persistent_cache)
+            assert stack.persistent_cache_key('aws_describe') == (
+                'stack:eu-central-1:424242424242:hello-world:aws_describe'
+            )
+            assert stack.resources['Bastion'].resource.persistent_cache_key('describe') == (
+                'arn:aws:cloudformation:eu-central-1:424242424242:stack/hello-world/'
+                '479d5820-1842-12e8-88f7-500c52a6ce62@2018-05-21 09:02:52.318000+00:00:'
+                'AWS::EC2::Instance:i-007d05f94c3bb8027:describe'
+            )
+
+    def test_keys_bound_to_account(self, default_fake_aws_env, persistent_cache):
+        with default_fake_aws_env.activate() as env:
+            self.mk_stack(env, persistent_cache).aws_describe
+            env.resource_config['sts']['get_caller_identity'] = lambda **kwargs: {'Account': '111111111111'}
+            other = self.mk_stack(env, persistent_cache)
+            assert other.persistent_cache_key('aws_describe') == (
+                'stack:eu-central-1:111111111111:hello-world:aws_describe'
+            )
+            other.aws_describe
+        # The stack of another account isn't served from the shared cache
+        assert env.client_mock.cloudformation.describe_stacks.call_count == 2
+
+
+class TestRefresh(object):
+
+    @pytest.fixture()
+    def events(self, default_fake_aws_env):
+        out = [
+            {'EventId': 'event-1', 'LogicalResourceId': 'hello-world', 'Timestamp': datetime.datetime(2020, 1, 1)},
+        ]
+        paginators = default_fake_aws_env.resource_config['cloudformation']['get_paginator']
+        # Events are returned newest first
+        paginators['describe_stack_events'] = lambda **kwargs: [{'StackEvents': list(reversed(out))}]
+        return out
+
+    def test_first_refresh(self, default_stack, events):
+        assert default_stack.refresh() == frozenset()
+        assert default_stack._last_event_id == 'event-1'
+
+    def test_first_refresh_after_load(self, default_stack, events):
+        bastion = default_stack.resources['Bastion']
+        bastion.resource.describe
+        # Changed after the data was loaded, before the first refresh
+        events.append({'EventId': 'event-2', 'LogicalResourceId': 'Bastion', 'Timestamp': datetime.datetime.utcnow()})
+        assert default_stack.refresh() == frozenset(['Bastion'])
+        assert not bastion.resource.is_cached('describe')
+        assert default_stack._last_event_id == 'event-2'
+
+    def test_first_refresh_of_unlimited_persisted_data(self, default_stack, events, tmpdir):
+        default_stack.persistent_cache = cfalchemy.SqliteCache(str(tmpdir), max_age=None)
+        default_stack.persistent_cache.set(default_stack.persistent_cache_key('aws_resources'), [])
+        assert default_stack.resources == {}
+        # Data of unknown age - everything is dropped
+        assert default_stack.refresh() == frozenset()
+        assert not default_stack.is_cached('resources')
+
+    def test_no_changes(self, default_stack, events):
+        default_stack.refresh()
+        instance = default_stack.resources['Bastion'].resource
+        instance.describe
+        assert default_stack.refresh() == frozenset()
+        assert instance.is_cached('describe')
+        assert default_stack.is_cached('aws_describe')
+
+    def test_changed_resources_invalidated(self, default_stack, default_fake_aws_env, events):
+        default_stack.refresh()
+        bastion = default_stack.resources['Bastion']
+        database = default_stack.resources['Database']
+        bastion.resource.describe
+        database.resource.describe
+        events.extend([
+            {'EventId': 'event-2', 'LogicalResourceId': 'Bastion'},
+            {'EventId': 'event-3', 'LogicalResourceId': 'hello-world'},
+        ])
+
+        assert default_stack.refresh() == frozenset(['Bastion', 'hello-world'])
+        assert not default_stack.is_cached('aws_describe')
+        assert not bastion.resource.is_cached('describe')
+        assert database.resource.is_cached('describe')
+        # Unchanged resource objects are preserved
+        assert default_stack.resources['Database'] is database
+        assert default_stack.resources['Bastion'] is not bastion
+        paginators = default_fake_aws_env.client_mock.cloudformation.paginators
+        assert paginators.list_stack_resources.paginate.call_count == 2
+
+    def test_resource_change_only(self, default_stack, events):
+        default_stack.refresh()
+        default_stack.resources
+        default_stack.aws_describe
+        events.append({'EventId': 'event-2', 'LogicalResourceId': 'Database'})
+        assert default_stack.refresh() == frozenset(['Database'])
+        assert default_stack.is_cached('aws_describe')
+
+    def test_lost_event_clears_everything(self, default_stack, events):
+        default_stack.refresh()
+        default_stack.resources
+        del events[:]
+        events.extend([
+            {'EventId': 'event-5', 'LogicalResourceId': 'Database'},
+        ])
+        assert default_stack.refresh() == frozenset(['Database'])
+        assert not default_stack.is_cached('resources')
+        assert default_stack._last_event_id == 'event-5'
+
+    def test_lost_event_reloads_resources(self, default_stack, default_fake_aws_env, events):
+        default_stack.refresh()
+        database = default_stack.resources['Database'].resource
+        assert database.available
+        # The database was stopped while the events were lost
+        stopped = copy.deepcopy(default_fake_aws_env.fake_boto.load_resoruce('rds', 'describe_db_instances'))
+        stopped['DBInstances'][0]['DBInstanceStatus'] = 'stopped'
+        default_fake_aws_env.resource_config['rds']['get_paginator']['describe_db_instances'] = (
+            lambda **kwargs: [stopped]
+        )
+        del events[:]
+        events.append({'EventId': 'event-5', 'LogicalResourceId': 'Database'})
+
+        default_stack.refresh()
+        assert default_stack.resources['Database'].resource is database
+        assert database.stopped
@@ -1,13 +1,20 @@
 import pytest
 import mock
+import botocore.exceptions
 
 import cfalchemy.stack.ec2 as ec2
+from tests.unit.util import fake_describe_instances
+
+
+@pytest.fixture()
+def fake_subnets(default_stack):
+    return default_stack.resources['PublicSubnet1'].resource.conn.describe_subnets
 
 
 class TestSubnet(object):
 
     @pytest.fixture()
-    def my_subnet(self, default_stack):
+    def my_subnet(self, default_stack, fake_subnets):
         return default_stack.resources['PublicSubnet1'].resource
 
     def test_describe(self, my_subnet):
@@ -18,6 +25,16 @@ class TestSubnet(object):
         assert my_subnet.subnet_id == 'subnet-dfffd2b4'
         assert my_subnet.availability_zone == 'eu-central-1a'
 
+    def test_batched_describe(self, default_stack, my_subnet, fake_subnets):
+        my_subnet.describe
+        assert fake_subnets.call_count == 1
+        subnet_ids = fake_subnets.call_args[1]['SubnetIds']
+        assert subnet_ids[0] == 'subnet-dfffd2b4'
+        assert len(subnet_ids) == len(default_stack.resources_by_type('AWS::EC2::Subnet'))
+        # Sibling subnets were described by the same call
+        assert default_stack.resources['AWSSubnet1'].resource.availability_zone == 'eu-central-1a'
+        assert fake_subnets.call_count == 1
+
 
 class TestInstance(object):
 
@@ -86,6 +103,20 @@ class TestInstance(object):
     def test_subnet(self, my_instance):
         assert my_instance.subnet.cfalchemy_uuid == 'cfalchemy::ec2::subnet::subnet-dfffd2b4'
 
+    def test_subnet_outside_of_stack(self, default_stack, fake_subnets):
+        instances = [default_stack.resources[name].resource for name in ('Bastion', 'RabbitMq')]
+        for (obj, subnet_id) in zip(instances, ('subnet-shared1', 'subnet-shared2')):
+            obj.prime_cache('describe', {'InstanceId': obj.name, 'SubnetId': subnet_id})
+        subnets = ec2.ECInstance.load_subnets(instances)
+
+        assert [el.subnet_id for el in subnets.values()] == ['subnet-shared1', 'subnet-shared2']
+        assert subnets['i-007d05f94c3bb8027'] is instances[0].subnet
+        assert instances[0].subnet is default_stack.resource_object(ec2.Subnet, 'subnet-shared1')
+        assert [el.availability_zone for el in subnets.values()] == ['eu-central-1a', 'eu-central-1a']
+        # Out-of-stack subnets are described in one batch along with the stack subnets
+        assert fake_subnets.call_count == 1
+        assert {'subnet-shared1', 'subnet-shared2'} <= set(fake_subnets.call_args[1]['SubnetIds'])
+
     def test_tags_get(self, my_instance):
         assert dict(my_instance.tags) == {
             'Name': 'sooty RabbitMQ server',
@@ -105,6 +136,33 @@ class TestInstance(object):
             ]
         )
 
+    def test_tags_reapplied(self, my_instance):
+        summary = my_instance.tags.full.update(
+            CreatedWith={'Value': 'create-stack.sh'},
+            hello={'Value': 'world'},
+        )
+        assert summary.unchanged == ('CreatedWith', )
+        my_instance.conn.create_tags.assert_called_once_with(
+            Resources=['i-007d05f94c3bb8027'],
+            Tags=[{'Key': 'hello', 'Value': 'world'}],
+        )
+
+    def test_tags_write_through(self, my_instance):
+        my_instance.stack.write_through_tags = True
+        tags = my_instance.tags
+        tags['hello'] = 'world'
+        del tags['CreatedWith']
+
+        assert my_instance.conn.create_tags.call_count == 1
+        assert my_instance.conn.delete_tags.call_count == 1
+        # Caches were updated rather than purged
+        assert my_instance.tags is tags
+        assert tags['hello'] == 'world'
+        assert 'CreatedWith' not in tags
+        assert {'Key': 'hello', 'Value': 'world'} in my_instance.describe['Tags']
+        assert 'CreatedWith' not in [el['Key'] for el in my_instance.describe['Tags']]
+        assert my_instance.conn.describe_instances.call_count == 1
+
     def test_tags_delete(self, my_instance):
         my_instance.tags.pop('CreatedWith')
         my_instance.conn.delete_tags.assert_called_with(
@@ -113,3 +171,152 @@ class TestInstance(object):
                 {'Key': 'CreatedWith'},
             ]
         )
+
+
+class TestBatchedDescribe(object):
+
+    @pytest.fixture()
+    def instances(self, default_stack):
+        out = (
+            default_stack.resources['Bastion'].resource,
+            default_stack.resources['RabbitMq'].resource,
+        )
+        out[0].conn.describe_instances.side_effect = fake_describe_instances
+        return out
+
+    def test_siblings_described_together(self, instances):
+        (bastion, rabbit) = instances
+        assert bastion.private_ip == 'ip-of-i-007d05f94c3bb8027'
+        assert rabbit.is_cached('describe')
+        assert rabbit.private_ip == 'ip-of-i-02dbbd53dbb355b05'
+        bastion.conn.describe_instances.assert_called_once_with(
+            InstanceIds=['i-007d05f94c3bb8027', 'i-02dbbd53dbb355b05']
+        )
+
+    def test_described_siblings_skipped(self, instances):
+        (bastion, rabbit) = instances
+        rabbit.describe
+        bastion.clear_cache()
+        bastion.describe
+        bastion.conn.describe_instances.assert_called_with(InstanceIds=['i-007d05f94c3bb8027'])
+        assert bastion.conn.describe_instances.call_count == 2
+
+    def test_chunked(self, instances):
+        (bastion, rabbit) = instances
+        with mock.patch.object(ec2.ECInstance, 'describe_batch_size', 1):
+            bastion.describe
+        assert bastion.conn.describe_instances.call_args_list == [
+            mock.call(InstanceIds=['i-007d05f94c3bb8027']),
+            mock.call(InstanceIds=['i-02dbbd53dbb355b05']),
+        ]
+        assert rabbit.is_cached('describe')
+
+    def test_fallback_on_client_error(self, instances):
+        (bastion, rabbit) = instances
+
+        def _describe(InstanceIds):
+            if len(InstanceIds) > 1:
+                raise botocore.exceptions.ClientError(
+                    {'Error': {'Code': 'InvalidInstanceID.NotFound'}}, 'DescribeInstances'
+                )
+            return fake_describe_instances(InstanceIds)
+
+        bastion.conn.describe_instances.side_effect = _describe
+        assert bastion.private_ip == 'ip-of-i-007d05f94c3bb8027'
+        # The rejected batch is bisected
+        assert rabbit.is_cached('describe')
+        assert bastion.conn.describe_instances.call_count == 3
+
+    def test_invalid_sibling(self, default_stack, instances):
+        (bastion, rabbit) = instances
+        # Instance that no longer exists
+        gone = default_stack.resource_object(ec2.ECInstance, 'i-gone')
+
+        def _describe(InstanceIds):
+            if 'i-gone' in InstanceIds:
+                raise botocore.exceptions.ClientError(
+                    {'Error': {'Code': 'InvalidInstanceID.NotFound'}}, 'DescribeInstances'
+                )
+            return fake_describe_instances(InstanceIds)
+
+        conn = bastion.conn
+        conn.describe_instances.side_effect = _describe
+        bastion.describe
+        assert rabbit.is_cached('describe')
+        # [bastion, rabbit, gone] -> [bastion], [rabbit, gone] -> [rabbit], [gone]
+        assert conn.describe_instances.call_count == 5
+
+        # The invalid id is remembered and left out of the later batches
+        with pytest.raises(botocore.exceptions.ClientError):
+            gone.describe
+        conn.describe_instances.assert_called_with(InstanceIds=['i-gone'])
+        bastion.invalidate('describe')
+        rabbit.invalidate('describe')
+        bastion.describe
+        conn.describe_instances.assert_called_with(InstanceIds=['i-007d05f94c3bb8027', 'i-02dbbd53dbb355b05'])
+        assert conn.describe_instances.call_count == 7
+
+    def test_transient_batch_error(self, instances):
+        (bastion, rabbit) = instances
+        throttled = botocore.exceptions.ClientError({'Error': {'Code': 'Throttling'}}, 'DescribeInstances')
+        conn = bastion.conn
+        conn.describe_instances.side_effect = throttled
+        with pytest.raises(botocore.exceptions.ClientError):
+            bastion.describe
+        # Neither resource is left out of the later batches
+        assert conn.describe_instances.call_count == 1
+        assert not bastion.batch_excluded and not rabbit.batch_excluded
+        conn.describe_instances.side_effect = fake_describe_instances
+        bastion.describe
+        conn.describe_instances.assert_called_with(InstanceIds=['i-007d05f94c3bb8027', 'i-02dbbd53dbb355b05'])
+
+
+def test_write_through_keeps_describe_age(default_stack):
+    default_stack.cache_ttl['describe'] = 30
+    default_stack.write_through_tags = True
+    instance = default_stack.resources['Bastion'].resource
+    default_stack.persistent_cache = mock.Mock()
+    with mock.patch('cfalchemy.stack.base.base.monotonic') as clock:
+        clock.return_value = 100
+        instance.prime_cache('describe', {'InstanceId': instance.name, 'Tags': []})
+        default_stack.persistent_cache.reset_mock()
+        clock.return_value = 125
+        instance.tags['owner'] = 'me'
+        assert instance.describe['Tags'] == [{'Key': 'owner', 'Value': 'me'}]
+        assert instance._cached_properties['describe'] == 130
+    # The persisted describe data is dropped, not saved as a fresh one
+    assert not default_stack.persistent_cache.set.called
+    assert default_stack.persistent_cache.delete.call_count == 1
+
+
+def test_describe_ttl_override(default_stack):
+    default_stack.cache_ttl['describe'] = 30
+    instance = default_stack.resources['Bastion'].resource
+    with mock.patch('cfalchemy.stack.base.base.monotonic') as clock:
+        clock.return_value = 100
+        instance.describe
+        instance.describe
+        assert instance.conn.describe_instances.call_count == 1
+        clock.return_value = 131
+        instance.describe
+        assert instance.conn.describe_instances.call_count == 2
+
+
+def test_derived_values_expire_with_describe(default_stack):
+    default_stack.cache_ttl['describe'] = 30
+    instance = default_stack.resources['Bastion'].resource
+    with mock.patch('cfalchemy.stack.base.base.monotonic') as clock:
+        clock.return_value = 100
+        instance.describe
+        clock.return_value = 120
+        # Derived from the describe data cached at 100
+        tags = instance.tags
+        subnet = instance.subnet
+        assert dict(tags)
+        clock.return_value = 125
+        assert instance.tags is tags
+        clock.return_value = 131
+        assert instance.tags is not tags
+        assert not instance.is_cached('subnet')
+        assert instance.subnet is subnet
+        assert instance.conn.describe_instances.call_count == 2
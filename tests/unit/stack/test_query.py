@@ -0,0 +1,75 @@
+import pytest
+import mock
+
+import cfalchemy.stack.ec2 as ec2
+import cfalchemy.stack.rds as rds
+
+
+def mk_instance(instance_id, state_code=16):
+    return {
+        'InstanceId': instance_id,
+        'State': {'Code': state_code},
+        'Tags': [{'Key': 'role', 'Value': 'web'}],
+    }
+
+
+class TestEc2Query(object):
+
+    @pytest.fixture()
+    def ec2_conn(self, default_stack):
+        conn = default_stack.boto_client('ec2')
+        conn.get_paginator.return_value.paginate.return_value = [
+            {'Reservations': [{'Instances': [mk_instance('i-007d05f94c3bb8027')]}]},
+            # Instance launched by an ASG of the same stack - not a resource of the stack
+            {'Reservations': [{'Instances': [mk_instance('i-00ed09c06862f64eb')]}]},
+        ]
+        return conn
+
+    def test_aws_side_filters(self, default_stack, ec2_conn):
+        found = default_stack.query(ec2.ECInstance).filter(state='running', tag={'role': 'web'}).all()
+
+        assert found == (default_stack.resources['Bastion'].resource, )
+        ec2_conn.get_paginator.assert_called_with('describe_instances')
+        filters = ec2_conn.get_paginator.return_value.paginate.call_args[1]['Filters']
+        assert sorted(filters, key=lambda el: el['Name']) == [
+            {'Name': 'instance-state-name', 'Values': ['running']},
+            {'Name': 'tag:aws:cloudformation:stack-name', 'Values': ['hello-world']},
+            {'Name': 'tag:role', 'Values': ['web']},
+        ]
+        # The query populates the describe cache
+        assert found[0].is_cached('describe')
+        assert not ec2_conn.describe_instances.called
+
+    def test_enum_and_multiple_values(self, default_stack, ec2_conn):
+        query = default_stack.query('AWS::EC2::Instance').filter(
+            state=[ec2.InstanceState.running, ec2.InstanceState.shutting_down]
+        )
+        assert len(query.all()) == 1
+        filters = ec2_conn.get_paginator.return_value.paginate.call_args[1]['Filters']
+        assert {'Name': 'instance-state-name', 'Values': ['running', 'shutting-down']} in filters
+
+    def test_in_memory_fallback(self, default_stack, ec2_conn):
+        query = default_stack.query(ec2.ECInstance).filter(tag={'role': 'web'})
+        assert len(query.filter(running=True).all()) == 1
+        assert query.filter(stopped=True).first() is None
+        filters = ec2_conn.get_paginator.return_value.paginate.call_args[1]['Filters']
+        assert [el['Name'] for el in filters if el['Name'] in ('running', 'stopped')] == []
+
+    def test_filter_merges_tags(self, default_stack):
+        query = default_stack.query(ec2.ECInstance).filter(tag={'a': '1'}).filter(tag={'b': '2'}, state='running')
+        assert query.criteria == {'tag': {'a': '1', 'b': '2'}, 'state': 'running'}
+        assert 'AWS::EC2::Instance' in repr(query)
+
+
+class TestInMemoryQuery(object):
+
+    def test_no_aws_filters(self, default_stack):
+        assert default_stack.query(rds.DBInstance).filter(port=5432).all() == (
+            default_stack.resources['Database'].resource,
+        )
+        assert default_stack.query(rds.DBInstance).filter(port=[1, 2]).all() == ()
+
+    def test_tags(self, default_stack):
+        query = default_stack.query(rds.DBInstance)
+        assert query.filter(tag={'Name': 'sooty Database'}).first() is default_stack.resources['Database'].resource
+        assert query.filter(tag={'Name': 'potato'}).first() is None
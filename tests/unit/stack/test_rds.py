@@ -52,3 +52,22 @@ class TestDbInstance(object):
             ResourceName=my_instance.arn,
             TagKeys=['CreatedWith']
         )
+
+    def test_batched_describe(self, my_instance, default_fake_aws_env):
+        assert my_instance.describe['DBInstanceIdentifier'] == 'sdb6e3j9i18bep'
+        conn = default_fake_aws_env.client_mock.rds
+        conn.get_paginator.assert_called_once_with('describe_db_instances')
+        conn.paginators.describe_db_instances.paginate.assert_called_once_with(
+            Filters=[{'Name': 'db-instance-id', 'Values': ['sdb6e3j9i18bep']}]
+        )
+        assert not conn.describe_db_instances.called
+
+    def test_tags_from_describe(self, my_instance):
+        describe = dict(my_instance.describe, TagList=[{'Key': 'Name', 'Value': 'inline'}])
+        my_instance.prime_cache('describe', describe)
+        assert dict(my_instance.tags) == {'Name': 'inline'}
+        assert not my_instance.conn.list_tags_for_resource.called
+
+        # Tag writes invalidate the describe data holding the tags
+        my_instance.tags['Name'] = 'updated'
+        assert not my_instance.is_cached('describe')
@@ -0,0 +1,158 @@
+import botocore.exceptions
+import mock
+import pytest
+
+from cfalchemy.stack.unit_of_work import WriteBehindQueue
+from tests.unit.util import fake_describe_instances
+
+
+@pytest.fixture()
+def instances(default_stack):
+    out = (
+        default_stack.resources['Bastion'].resource,
+        default_stack.resources['RabbitMq'].resource,
+    )
+    out[0].conn.describe_instances.side_effect = lambda InstanceIds: fake_describe_instances(InstanceIds)
+    for (obj, tags) in zip(out, ([{'Key': 'CreatedWith', 'Value': 'me'}], [])):
+        obj.prime_cache('describe', {'InstanceId': obj.name, 'Tags': tags})
+    return out
+
+
+def test_ec2_writes_coalesced(default_stack, instances):
+    conn = instances[0].conn
+    with default_stack.unit_of_work() as uow:
+        for obj in instances:
+            obj.tags['owner'] = 'team-a'
+            obj.tags.pop('CreatedWith', None)
+        assert len(uow) == 2
+        # Writes are deferred, but visible to the reads
+        assert not conn.create_tags.called
+        assert dict(instances[0].tags) == {'owner': 'team-a'}
+
+    conn.create_tags.assert_called_once_with(
+        Resources=['i-007d05f94c3bb8027', 'i-02dbbd53dbb355b05'],
+        Tags=[{'Key': 'owner', 'Value': 'team-a'}],
+    )
+    # Deletion of a tag RabbitMq doesn't have is a no-op
+    conn.delete_tags.assert_called_once_with(
+        Resources=['i-007d05f94c3bb8027'],
+        Tags=[{'Key': 'CreatedWith'}],
+    )
+
+
+def test_ec2_write_through(default_stack, instances):
+    default_stack.write_through_tags = True
+    with default_stack.unit_of_work():
+        for obj in instances:
+            obj.tags['owner'] = 'team-a'
+    assert instances[0].describe['Tags'] == [
+        {'Key': 'CreatedWith', 'Value': 'me'},
+        {'Key': 'owner', 'Value': 'team-a'},
+    ]
+    assert dict(instances[1].tags) == {'owner': 'team-a'}
+    assert not instances[0].conn.describe_instances.called
+
+
+def test_asg_writes_batched(default_stack):
+    groups = [default_stack.resources[name].resource for name in ('DevToolsASG', 'CeleryWorkerASG')]
+    with default_stack.unit_of_work():
+        for obj in groups:
+            obj.tags['owner'] = 'team-a'
+    conn = groups[0].conn
+    assert conn.create_or_update_tags.call_count == 1
+    tags = conn.create_or_update_tags.call_args[1]['Tags']
+    assert sorted(el['ResourceId'] for el in tags) == sorted(obj.name for obj in groups)
+    assert all(el['ResourceType'] == 'auto-scaling-group' and el['Value'] == 'team-a' for el in tags)
+
+
+def test_unbatched_resources(default_stack):
+    database = default_stack.resources['Database'].resource
+    with default_stack.unit_of_work():
+        database.tags['hello'] = 'world'
+        assert not database.conn.add_tags_to_resource.called
+    database.conn.add_tags_to_resource.assert_called_once_with(
+        ResourceName=database.arn,
+        Tags=[{'Key': 'hello', 'Value': 'world'}],
+    )
+
+
+def test_deferred_writes_survive_cache_drops(default_stack, instances):
+    bastion = instances[0]
+    default_stack.cache_ttl['describe'] = 30
+    with mock.patch('cfalchemy.stack.base.base.monotonic') as clock:
+        clock.return_value = 100
+        bastion.prime_cache('describe', {'InstanceId': bastion.name, 'Tags': []})
+        with default_stack.unit_of_work():
+            bastion.tags['owner'] = 'me'
+            # Expired, cleared and invalidated caches keep the deferred write and re-read AWS state
+            clock.return_value = 131
+            assert dict(bastion.tags) == {'owner': 'me'}
+            default_stack.clear_cache()
+            assert dict(bastion.tags) == {'owner': 'me'}
+            bastion.invalidate('tags')
+            assert bastion.tags['owner'] == 'me'
+    bastion.conn.create_tags.assert_called_once_with(Resources=[bastion.name], Tags=[{'Key': 'owner', 'Value': 'me'}])
+
+
+def test_discarded_on_error(default_stack, instances):
+    with pytest.raises(ValueError):
+        with default_stack.unit_of_work():
+            instances[0].tags['owner'] = 'team-a'
+            raise ValueError()
+    assert not instances[0].conn.create_tags.called
+    assert dict(instances[0].tags) == {'CreatedWith': 'me'}
+    assert default_stack.active_tag_writer is None
+
+
+class TestWriteBehind(object):
+
+    @pytest.fixture()
+    def queue(self, default_stack):
+        default_stack.write_behind = WriteBehindQueue(delay=0.05, retry_delay=0)
+        yield default_stack.write_behind
+        default_stack.write_behind.close(timeout=5)
+
+    def test_writes_coalesced(self, queue, instances):
+        for obj in instances:
+            obj.tags['owner'] = 'team-a'
+        instances[0].tags['owner'] = 'team-b'
+        # Reads see the pending writes
+        assert instances[0].tags['owner'] == 'team-b'
+        queue.flush(timeout=5)
+
+        conn = instances[0].conn
+        assert sorted(
+            (tuple(call[1]['Resources']), call[1]['Tags'][0]['Value'])
+            for call in conn.create_tags.call_args_list
+        ) == [(('i-007d05f94c3bb8027', ), 'team-b'), (('i-02dbbd53dbb355b05', ), 'team-a')]
+        assert len(queue) == 0
+
+    def test_future(self, queue, instances):
+        instances[0].tags['owner'] = 'team-a'
+        future = queue.future()
+        assert future.result(timeout=5) is None
+        assert instances[0].conn.create_tags.called
+        assert queue.future().done()
+
+    def test_cache_cleared_before_write(self, queue, instances):
+        queue.delay = 5
+        instances[0].tags['owner'] = 'team-a'
+        instances[0].clear_cache()
+        assert instances[0].tags['owner'] == 'team-a'
+        queue.flush(timeout=5)
+        assert instances[0].conn.create_tags.called
+
+    def test_retries(self, queue, instances):
+        throttled = botocore.exceptions.ClientError({'Error': {'Code': 'RequestLimitExceeded'}}, 'CreateTags')
+        instances[0].conn.create_tags.side_effect = [throttled, None]
+        instances[0].tags['owner'] = 'team-a'
+        queue.flush(timeout=5)
+        assert instances[0].conn.create_tags.call_count == 2
+
+    def test_failure(self, queue, instances):
+        denied = botocore.exceptions.ClientError({'Error': {'Code': 'AccessDenied'}}, 'CreateTags')
+        instances[0].conn.create_tags.side_effect = denied
+        instances[0].tags['owner'] = 'team-a'
+        with pytest.raises(botocore.exceptions.ClientError):
+            queue.flush(timeout=5)
+        assert instances[0].conn.create_tags.call_count == 1
@@ -0,0 +1,90 @@
+import botocore.exceptions
+import pytest
+
+from cfalchemy.stack.ec2 import InstanceState
+from cfalchemy.stack.waiter import Poller, WaitTimeout, state_predicate
+
+
+@pytest.fixture()
+def poller(default_stack):
+    default_stack.poller = Poller(min_delay=0.01, max_delay=0.05, jitter=0)
+    return default_stack.poller
+
+
+@pytest.fixture()
+def instances(default_stack):
+    out = [default_stack.resources[name].resource for name in ('Bastion', 'RabbitMq')]
+    # Instances are pending on the first describe and running on the following ones
+    states = iter([InstanceState.pending] + [InstanceState.running] * 100)
+
+    def describe_instances(InstanceIds):
+        state = next(states)
+        return {'Reservations': [{'Instances': [
+            {'InstanceId': instance_id, 'State': {'Code': state.value, 'Name': state.name}}
+            for instance_id in InstanceIds
+        ]}]}
+
+    out[0].conn.describe_instances.side_effect = describe_instances
+    return out
+
+
+def test_wait_until(default_stack, poller, instances):
+    # Stale cached state is re-described
+    instances[0].prime_cache('describe', {'State': {'Code': InstanceState.running.value}})
+    assert default_stack.wait_until(['Bastion', instances[1]], 'running', timeout=5) == {}
+    conn = instances[0].conn
+    assert conn.describe_instances.call_count == 2
+    for call in conn.describe_instances.call_args_list:
+        # All watched instances are described with one call per tick
+        assert call[1]['InstanceIds'] == [obj.name for obj in instances]
+    assert all(obj.running for obj in instances)
+    assert len(poller) == 0
+
+
+def test_watch(default_stack, poller, instances):
+    futures = default_stack.watch(instances, InstanceState.running, timeout=5)
+    assert list(futures) == [obj.name for obj in instances]
+    assert futures[instances[0].name].result(timeout=5) is instances[0]
+
+
+def test_timeout(default_stack, poller, instances):
+    errors = default_stack.wait_until(instances[:1], 'stopped', timeout=0.1)
+    assert list(errors) == [instances[0].name]
+    assert isinstance(errors[instances[0].name], WaitTimeout)
+    assert errors[instances[0].name].resource is instances[0]
+
+
+def test_unbatched_and_derived_states(default_stack, poller):
+    # DevToolsASG has one of the two desired instances
+    names = ['DevToolsASG', 'CeleryWorkerASG']
+    errors = default_stack.wait_until(names, 'converged', timeout=0.05)
+    assert sorted(errors) == sorted(default_stack.resources[name].physical_id for name in names)
+    assert default_stack.wait_until(['DevToolsASG'], lambda obj: obj.desired_capacity == 2, timeout=5) == {}
+    database = default_stack.resources['Database'].resource
+    assert default_stack.wait_until([database], lambda obj: obj.available, timeout=5) == {}
+
+
+def test_state_predicate():
+    assert state_predicate('running')(type('Obj', (object, ), {'running': True})())
+    with pytest.raises(TypeError):
+        state_predicate(42)
+
+
+def test_describe_error(default_stack, poller, instances):
+    denied = botocore.exceptions.ClientError({'Error': {'Code': 'UnauthorizedOperation'}}, 'DescribeInstances')
+    instances[0].conn.describe_instances.side_effect = denied
+    errors = default_stack.wait_until(instances, 'running')
+    assert errors == {obj.name: denied for obj in instances}
+    assert len(poller) == 0
+
+
+def test_throttled_polls_bounded(default_stack, poller, instances):
+    poller.max_failed_polls = 3
+    throttled = botocore.exceptions.ClientError({'Error': {'Code': 'RequestLimitExceeded'}}, 'DescribeInstances')
+    conn = instances[0].conn
+    conn.describe_instances.side_effect = throttled
+    errors = default_stack.wait_until(instances[:1], 'running')
+    assert errors == {instances[0].name: throttled}
+    # One batch call per poll, the throttled batch isn't followed by single-resource describes
+    assert conn.describe_instances.call_count == 3
+    assert not instances[0].batch_excluded
@@ -0,0 +1,90 @@
+import threading
+
+import botocore.config
+import mock
+import pytest
+
+import cfalchemy
+import cfalchemy.client_pool
+
+
+class TestClientPool:
+
+    @pytest.fixture()
+    def pool(self):
+        return cfalchemy.client_pool.ClientPool(max_pool_connections=42)
+
+    def test_client_reused(self, pool, fake_boto3):
+        with fake_boto3.patch() as mocks:
+            mocks['client'].side_effect = lambda *args, **kwargs: mock.Mock()
+            ec2_1 = pool.get('ec2', region_name='eu-central-1')
+            ec2_2 = pool.get('ec2', region_name='eu-central-1')
+            ec2_other_region = pool.get('ec2', region_name='eu-west-1')
+            rds = pool.get('rds', region_name='eu-central-1')
+
+        assert ec2_1 is ec2_2
+        assert ec2_1 is not ec2_other_region
+        assert ec2_1 is not rds
+        assert mocks['client'].call_count == 3
+        assert len(pool) == 3
+
+    def test_max_pool_connections(self, pool, fake_boto3):
+        with fake_boto3.patch() as mocks:
+            pool.get('ec2', region_name='eu-central-1')
+
+        (args, kwargs) = mocks['client'].call_args
+        assert args == ('ec2', )
+        assert kwargs['region_name'] == 'eu-central-1'
+        assert kwargs['config'].max_pool_connections == 42
+
+    def test_user_config_merged(self, pool, fake_boto3):
+        user_config = botocore.config.Config(connect_timeout=7)
+        with fake_boto3.patch() as mocks:
+            pool.get('ec2', config=user_config)
+
+        config = mocks['client'].call_args[1]['config']
+        assert config.max_pool_connections == 42
+        assert config.connect_timeout == 7
+
+    def test_clear(self, pool, fake_boto3):
+        with fake_boto3.patch() as mocks:
+            mocks['client'].side_effect = lambda *args, **kwargs: mock.Mock()
+            client_1 = pool.get('ec2')
+            pool.clear()
+            client_2 = pool.get('ec2')
+
+        assert client_1 is not client_2
+
+    def test_threaded_creation(self, pool, fake_boto3):
+        start = threading.Event()
+        results = []
+
+        def _run():
+            start.wait()
+            results.append(pool.get('ec2'))
+
+        with fake_boto3.patch() as mocks:
+            mocks['client'].side_effect = lambda *args, **kwargs: mock.Mock()
+            threads = [threading.Thread(target=_run) for _ in range(16)]
+            for thread in threads:
+                thread.start()
+            start.set()
+            for thread in threads:
+                thread.join()
+
+        assert len(results) == 16
+        assert all(el is results[0] for el in results)
+        assert mocks['client'].call_count == 1
+
+
+def test_clients_shared_between_stacks(fake_boto3):
+    pool = cfalchemy.ClientPool()
+    with fake_boto3.patch() as mocks:
+        mocks['client'].side_effect = lambda *args, **kwargs: mock.Mock()
+        stack1 = cfalchemy.client('stack-1', client_pool=pool, region_name='eu-central-1')
+        stack2 = cfalchemy.client('stack-2', client_pool=pool, region_name='eu-central-1')
+        stack3 = cfalchemy.client('stack-3', client_pool=pool, region_name='eu-west-1')
+
+    assert stack1.conn is stack2.conn
+    assert stack1.conn is not stack3.conn
+    assert mocks['client'].call_count == 2
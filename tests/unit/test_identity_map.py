@@ -0,0 +1,58 @@
+import gc
+
+import cfalchemy.identity_map
+
+
+class Obj(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class TestIdentityMap:
+
+    def test_get_or_create(self):
+        imap = cfalchemy.identity_map.IdentityMap()
+        obj1 = imap.get_or_create(Obj, 'a', lambda: Obj('a'))
+        assert imap.get_or_create(Obj, 'a', lambda: Obj('other')) is obj1
+        assert imap.get(Obj, 'a') is obj1
+        obj2 = imap.get_or_create(Obj, 'b', lambda: Obj('b'))
+        assert obj2 is not obj1
+        assert (Obj, 'a') in imap
+        assert len(imap) == 2
+        assert 'objects=2' in repr(imap)
+
+    def test_weak_refs(self):
+        imap = cfalchemy.identity_map.IdentityMap()
+        imap.get_or_create(Obj, 'a', lambda: Obj('a'))
+        gc.collect()
+        assert imap.get(Obj, 'a') is None
+        assert len(imap) == 0
+
+    def test_lru(self):
+        imap = cfalchemy.identity_map.IdentityMap(lru_size=2)
+        for name in ('a', 'b', 'c'):
+            imap.get_or_create(Obj, name, lambda: Obj(name))
+        # Refresh 'b' so 'c' is the oldest entry
+        imap.get_or_create(Obj, 'b', lambda: Obj('b'))
+        imap.get_or_create(Obj, 'd', lambda: Obj('d'))
+        gc.collect()
+        assert imap.get(Obj, 'a') is None
+        assert imap.get(Obj, 'c') is None
+        assert imap.get(Obj, 'b').name == 'b'
+        assert imap.get(Obj, 'd').name == 'd'
+
+    def test_discard(self):
+        imap = cfalchemy.identity_map.IdentityMap(lru_size=10)
+        obj = imap.get_or_create(Obj, 'a', lambda: Obj('a'))
+        imap.discard(Obj, 'a')
+        assert imap.get(Obj, 'a') is None
+        assert imap.get_or_create(Obj, 'a', lambda: Obj('a')) is not obj
+
+    def test_objects(self):
+        imap = cfalchemy.identity_map.IdentityMap()
+        objs = [imap.get_or_create(Obj, name, lambda: Obj(name)) for name in ('a', 'b')]
+        other = imap.get_or_create(str, 'c', lambda: Obj('c'))
+        assert sorted(el.name for el in imap.objects(Obj)) == ['a', 'b']
+        assert len(imap.objects()) == 3
+        assert objs and other
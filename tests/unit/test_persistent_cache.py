@@ -0,0 +1,78 @@
+import datetime
+import sqlite3
+
+import mock
+import pytest
+
+import cfalchemy.persistent_cache
+
+
+class TestSqliteCache:
+
+    @pytest.fixture()
+    def cache(self, tmpdir):
+        return cfalchemy.persistent_cache.SqliteCache(str(tmpdir.join('cache-dir')), max_age=100)
+
+    @pytest.fixture()
+    def clock(self):
+        with mock.patch('cfalchemy.persistent_cache.time.time') as time_mock:
+            time_mock.return_value = 1000
+            yield time_mock
+
+    def test_set_get(self, cache):
+        value = {'Tags': [{'Key': 'a', 'Value': 'b'}], 'LaunchTime': datetime.datetime(2018, 5, 23, 7, 43)}
+        cache.set('key-1', value)
+        assert cache.get('key-1') == value
+        with pytest.raises(KeyError):
+            cache.get('key-2')
+
+    def test_shared_between_instances(self, cache):
+        cache.set('key-1', 'hello')
+        other = cfalchemy.persistent_cache.SqliteCache(cache.path.rsplit('/', 1)[0])
+        assert other.get('key-1') == 'hello'
+
+    def test_max_age(self, cache, clock):
+        cache.set('key-1', 'hello')
+        clock.return_value = 1050
+        assert cache.get('key-1') == 'hello'
+        with pytest.raises(KeyError):
+            cache.get('key-1', max_age=50)
+        clock.return_value = 1100
+        with pytest.raises(KeyError):
+            cache.get('key-1')
+
+    def test_not_before(self, cache, clock):
+        cache.set('key-1', 'hello')
+        assert cache.get('key-1', not_before=1000) == 'hello'
+        with pytest.raises(KeyError):
+            cache.get('key-1', not_before=1001)
+
+    def test_delete_clear(self, cache):
+        cache.set('key-1', 'hello')
+        cache.set('key-2', 'world')
+        cache.delete('key-1')
+        with pytest.raises(KeyError):
+            cache.get('key-1')
+        assert cache.get('key-2') == 'world'
+        cache.clear()
+        with pytest.raises(KeyError):
+            cache.get('key-2')
+
+    def test_corrupt_file(self, tmpdir):
+        with open(str(tmpdir.join('cfalchemy-cache.sqlite3')), 'wb') as f:
+            f.write(b'not a database' * 100)
+        cache = cfalchemy.persistent_cache.SqliteCache(str(tmpdir))
+        # Errors are logged, the cache acts as if it was empty
+        cache.set('key-1', 'hello')
+        with pytest.raises(KeyError):
+            cache.get('key-1')
+        cache.delete('key-1')
+        cache.clear()
+
+    def test_locked_database(self, cache):
+        cache.set('key-1', 'hello')
+        cache._conn = mock.MagicMock()
+        cache._conn.execute.side_effect = sqlite3.OperationalError('database is locked')
+        with pytest.raises(KeyError):
+            cache.get('key-1')
+        cache.set('key-1', 'world')
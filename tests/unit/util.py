@@ -1,6 +1,7 @@
 """Utility functions"""
 import os
 import contextlib
+import copy
 import mock
 import yaml
 
@@ -17,6 +18,52 @@ def load_resource(*path):
         return yaml.load(fobj)
 
 
+def fake_describe_instances(InstanceIds):
+    """Fake ec2 `describe_instances` that returns minimal record for every requested instance id"""
+    return {
+        'Reservations': [
+            {
+                'Instances': [
+                    {'InstanceId': instance_id, 'PrivateIpAddress': 'ip-of-{}'.format(instance_id), 'Tags': []}
+                ]
+            }
+            for instance_id in InstanceIds
+        ]
+    }
+
+
+def fake_describe_subnets(response, SubnetIds):
+    """Fake ec2 `describe_subnets` that returns a copy of the first subnet of the `response` for every requested id"""
+    template = response['Subnets'][0]
+    out = []
+    for subnet_id in SubnetIds:
+        subnet = copy.deepcopy(template)
+        subnet['SubnetId'] = subnet_id
+        out.append(subnet)
+    return {'Subnets': out}
+
+
+def fake_describe_auto_scaling_groups(response, AutoScalingGroupNames):
+    """Fake `describe_auto_scaling_groups` page that returns a group for every requested name.
+
+    The first group of the `response` is returned as is if requested, other groups are copies of it without instances.
+    """
+    template = response['AutoScalingGroups'][0]
+    out = []
+    for name in AutoScalingGroupNames:
+        if name == template['AutoScalingGroupName']:
+            out.append(template)
+            continue
+        group = copy.deepcopy(template)
+        group['AutoScalingGroupName'] = name
+        group['AutoScalingGroupARN'] = template['AutoScalingGroupARN'].replace(template['AutoScalingGroupName'], name)
+        group['Instances'] = []
+        for tag in group['Tags']:
+            tag['ResourceId'] = name
+        out.append(group)
+    return {'AutoScalingGroups': out}
+
+
 class FakeBoto(object):
 
     current_mock = None